@@ -4,6 +4,8 @@ import pandas as pd
 
 from utils.config import paths
 from utils.logging_utils import get_logger
+from utils.parquet_utils import write_parquet
+from utils.schema_utils import ALLOCATION
 
 logger = get_logger("allocation_data")
 
@@ -22,27 +24,7 @@ def main():
         logger.info("Allocation file loaded with %d rows and %d columns", df.shape[0], df.shape[1])
 
         # Robust column detection
-        possible_cols = [
-            "customer_id",
-            "customerID",
-            "CustomerID",
-            "Customer_ID",
-            "Customer Id",
-            "Customer Id ",
-            "Customer Ids",
-        ]
-        found_col = None
-        for c in possible_cols:
-            if c in df.columns:
-                found_col = c
-                break
-        if found_col is None:
-            # try case-insensitive
-            lower_map = {c.lower(): c for c in df.columns}
-            for c in ["customer_id", "customerid", "customer id"]:
-                if c in lower_map:
-                    found_col = lower_map[c]
-                    break
+        found_col = ALLOCATION.resolve(df.columns).source_of("customer_id")
         if found_col is None:
             logger.error("Could not find customer_id column in allocation file. Columns: %s", list(df.columns))
             sys.exit(2)
@@ -56,7 +38,7 @@ def main():
         logger.info("Extracted %d unique customer_ids", out.shape[0])
 
         output_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
-        out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("Allocation Data extraction completed successfully")
     except Exception as e:
@@ -3,9 +3,12 @@ import sys
 import pandas as pd
 from datetime import date
 
-from utils.config import paths
+from utils import duckdb_backend
+from utils.config import paths, redshift, execution
 from utils.logging_utils import get_logger
-from utils.db_utils import redshift_conn, run_query
+from utils.parquet_utils import write_parquet
+from utils.db_utils import delete_unloaded, fetch_chunks, read_unloaded_parquet, redshift_conn, run_query, unload_to_parquet
+from utils.memory_utils import SpillingAggregator, budget_for
 
 logger = get_logger("app_login")
 
@@ -20,6 +23,20 @@ WHERE
    AND DATE(create_date) > :cutoff_date;
 """
 
+LOGIN_COLUMNS = ["customer_id", "create_date", "source", "app_type"]
+
+
+def reduce_latest(df: pd.DataFrame) -> pd.DataFrame:
+    # Only each customer's latest login can matter, so chunks are reduced before they accumulate
+    return df.sort_values("create_date").groupby("customer_id", as_index=False).tail(1)
+
+
+def latest_logins(df: pd.DataFrame) -> pd.DataFrame:
+    latest = reduce_latest(df)
+    latest = latest[["customer_id", "create_date"]].rename(columns={"create_date": "latest_login_date"})
+    latest["app_login"] = "Yes"
+    return latest
+
 
 def main():
     try:
@@ -30,23 +47,45 @@ def main():
         logger.info("Cutoff date for this month: %s", cutoff_str)
 
         with redshift_conn() as conn:
-            logger.info("Querying Redshift for login data...")
-            res = run_query(conn, SQL, {"cutoff_date": cutoff_str})
-            rows = res.fetchall()
-            logger.info("Fetched %d rows", len(rows))
+            if redshift.export_mode == "unload":
+                logger.info("Unloading login data from Redshift to Parquet...")
+                prefix = unload_to_parquet(conn, SQL, {"cutoff_date": cutoff_str}, label="app_login")
+            else:
+                logger.info("Querying Redshift for login data...")
+                budget = budget_for("app_login")
+                res = run_query(conn, SQL, {"cutoff_date": cutoff_str}, stream=True)
+                chunks = fetch_chunks(res, LOGIN_COLUMNS, budget)
+                if execution.backend == "duckdb":
+                    # DuckDB takes the fetched chunks as they are and does all the grouping (and spilling) itself
+                    latest = duckdb_backend.latest_logins(chunks)
+                else:
+                    partials = SpillingAggregator(budget, reduce_latest)
+                    for chunk in chunks:
+                        partials.add(reduce_latest(chunk))
+                    df = partials.result()
+                    latest = df if df.empty else latest_logins(df.assign(customer_id=lambda d: d["customer_id"].astype(str)))
+
+        if redshift.export_mode == "unload":
+            table = read_unloaded_parquet(prefix)
+            if redshift.unload_cleanup:
+                delete_unloaded(prefix)
+            logger.info("Read %d unloaded rows", table.num_rows)
+            df = table.to_pandas() if table.num_rows else pd.DataFrame(columns=LOGIN_COLUMNS)
+            df = df[LOGIN_COLUMNS]
+            if df.empty:
+                latest = df
+            else:
+                df = df.assign(customer_id=lambda d: d["customer_id"].astype(str))
+                # Aggregate to required 3 columns
+                if execution.backend == "duckdb":
+                    latest = duckdb_backend.latest_logins(df)
+                else:
+                    latest = latest_logins(df)
 
-        if not rows:
+        if latest.empty:
             logger.warning("No rows returned from Redshift")
-            df = pd.DataFrame(columns=["customer_id", "app_login", "latest_login_date"])
+            out = pd.DataFrame(columns=["customer_id", "app_login", "latest_login_date"])
         else:
-            df = pd.DataFrame(rows, columns=["customer_id", "create_date", "source", "app_type"]) \
-                .assign(customer_id=lambda d: d["customer_id"].astype(str))
-
-            # Aggregate to required 3 columns
-            latest = df.sort_values("create_date").groupby("customer_id", as_index=False).tail(1)
-            latest = latest[["customer_id", "create_date"]].rename(columns={"create_date": "latest_login_date"})
-            latest["app_login"] = "Yes"
-
             # Include customers with no login as No? For only those in allocation. Load allocation ids if present
             alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
             if os.path.exists(alloc_path):
@@ -61,8 +100,7 @@ def main():
             out = out[["customer_id", "app_login", "latest_login_date"]]
 
         output_path = os.path.join(paths.output_dir, "app_login.parquet")
-        df_out = df if df.empty else out
-        df_out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("App Login extraction completed successfully")
     except Exception as e:
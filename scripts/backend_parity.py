@@ -0,0 +1,219 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from utils import duckdb_backend
+from utils.config import paths
+from utils.logging_utils import get_logger
+from utils.parquet_utils import write_parquet
+from scripts import app_login, comments_report, compile_master, ivr_data, tickets_data
+
+logger = get_logger("backend_parity")
+
+TODAY = date.today()
+
+
+def _timestamps(rng: np.random.Generator, n: int, days: int) -> pd.Series:
+    # Distinct timestamps so "latest"/"earliest" picks have no ties between backends
+    start = pd.Timestamp(TODAY).normalize() - pd.Timedelta(days=days)
+    millis = rng.choice(days * 86400 * 1000, size=n, replace=False)
+    return pd.Series(start + pd.to_timedelta(np.sort(millis), unit="ms"))
+
+
+def synthetic(n_customers: int, seed: int = 7) -> dict:
+    rng = np.random.default_rng(seed)
+    ids = np.arange(100000, 100000 + n_customers)
+    labels = comments_report.PRIORITY + ["Something Else"]
+
+    n = n_customers * 5
+    comments = pd.DataFrame({
+        "customer_id": rng.choice(ids, n),
+        "collection_disposition": rng.choice(labels, n),
+        "collection_sub_disposition": pd.Series(rng.choice(labels, n)).where(rng.random(n) > 0.3, None),
+        "collection_sub_disposition2": None,
+        "callback_date": _timestamps(rng, n, 20).where(rng.random(n) > 0.5),
+        "ptp_date": _timestamps(rng, n, 20).where(rng.random(n) > 0.5),
+        "comment_date": _timestamps(rng, n, max(TODAY.day, 2)),
+    })
+    comments = comments.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    n = n_customers * 2
+    tickets = pd.DataFrame({
+        "user_id": rng.choice(ids, n),
+        "source": rng.choice(["app", "email", "call", "chat"], n),
+        "create_date": _timestamps(rng, n, 800).dt.date,
+    })
+    # One ticket per customer per day keeps the "latest" pick unambiguous
+    tickets = tickets.drop_duplicates(["user_id", "create_date"])
+
+    n = n_customers * 3
+    logins = pd.DataFrame({
+        "customer_id": rng.choice(ids, n).astype(str),
+        "create_date": _timestamps(rng, n, max(TODAY.day, 2)),
+        "source": "app",
+        "app_type": rng.choice(["android", "ios"], n),
+    })
+
+    n = n_customers * 10
+    ivr_calls = pd.DataFrame({
+        "CustomerID": rng.choice(ids, n),
+        "startDate": _timestamps(rng, n, 40).dt.floor("s"),
+        "disposition": pd.Series(rng.choice(["ANSWERED", "answered", "NO ANSWER", "BUSY"], n)).where(
+            rng.random(n) > 0.05, None
+        ),
+        "campaignName": "collections",
+    })
+    return {"ids": ids, "comments": comments, "tickets": tickets, "logins": logins, "ivr_calls": ivr_calls}
+
+
+# How real dialer exports write call times; the last one is not a date at all. DuckDB scans the first five,
+# the others (fractional seconds, a UTC offset, year-first slashes) go through pandas.
+DATE_STYLES = [
+    "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%m/%d/%Y %I:%M %p", "%d-%b-%Y %H:%M", "%d-%m-%Y %H:%M",
+    "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S+05:30", "unparseable",
+]
+
+
+def write_ivr_dumps(calls: pd.DataFrame, folder: str, files: int = 8, seed: int = 7) -> list:
+    """Split calls over CSV dumps the way real ones arrive, plus one Excel dump and one payments file.
+
+    Dumps vary the customer header spelling and the date format, and some have blank CustomerID cells,
+    a few unparseable dates or dates padded with spaces, so both backends must clean ids and dates the
+    same way.
+    """
+    rng = np.random.default_rng(seed)
+    paths_out = []
+    spellings = ["CustomerID", "Customer ID", "customer_id", "CUSTOMERID"]
+    bounds = np.linspace(0, len(calls) - 200, files + 1).astype(int)
+    for i in range(files):
+        part = calls.iloc[bounds[i]:bounds[i + 1]].copy()
+        style = DATE_STYLES[i % (len(DATE_STYLES) - 1)]
+        part["startDate"] = part["startDate"].dt.strftime(style)
+        if i % 2:
+            part["CustomerID"] = part["CustomerID"].astype(object).where(rng.random(len(part)) > 0.01, None)
+            part["startDate"] = part["startDate"].where(rng.random(len(part)) > 0.01, DATE_STYLES[-1])
+            part["startDate"] = part["startDate"].where(rng.random(len(part)) > 0.01, " " + part["startDate"])
+        path = os.path.join(folder, f"ivr_{i:02d}.csv")
+        part.rename(columns={"CustomerID": spellings[i % len(spellings)]}).to_csv(path, index=False)
+        paths_out.append(path)
+    path = os.path.join(folder, "ivr_tail.xlsx")
+    tail = calls.iloc[-200:].copy()
+    tail["CustomerID"] = tail["CustomerID"].astype(object).where(rng.random(len(tail)) > 0.05, None)
+    tail.to_excel(path, index=False)
+    paths_out.append(path)
+    path = os.path.join(folder, "payments.csv")
+    pd.DataFrame({"customer_id": calls["CustomerID"].head(10), "amt_payment": 100}).to_csv(path, index=False)
+    paths_out.append(path)
+    return paths_out
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df["customer_id"] = df["customer_id"].astype(str)
+    for c in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = df[c].astype("datetime64[ns]")
+    df = df.sort_values(list(df.columns[:2])).reset_index(drop=True)[sorted(df.columns)]
+    # One missing-value marker, so NaN from a pandas merge and None from DuckDB compare equal
+    return df.astype(object).where(df.notna(), None)
+
+
+def compare(name: str, run_pandas, run_duckdb) -> dict:
+    t0 = time.perf_counter()
+    expected = run_pandas()
+    t1 = time.perf_counter()
+    actual = run_duckdb()
+    t2 = time.perf_counter()
+    ok = True
+    try:
+        pd.testing.assert_frame_equal(normalize(expected), normalize(actual), check_dtype=False)
+    except AssertionError as e:
+        ok = False
+        logger.error("%s: backends differ\n%s", name, e)
+    # Logged as each stage finishes so a large run that is cut short still leaves its timings
+    logger.info("%s: %d rows, pandas %.3fs, duckdb %.3fs, parity %s", name, len(expected), t1 - t0, t2 - t1, ok)
+    return {"stage": name, "rows": len(expected), "pandas_s": t1 - t0, "duckdb_s": t2 - t1, "parity": ok}
+
+
+def run(n_customers: int) -> pd.DataFrame:
+    data = synthetic(n_customers)
+    previous_output_dir = paths.output_dir
+    with tempfile.TemporaryDirectory() as tmp:
+        paths.output_dir = tmp
+        try:
+            # The raw calls are only needed as dumps on disk; dropping them keeps large runs in memory
+            files = write_ivr_dumps(data.pop("ivr_calls"), tmp)
+            results = [
+                compare(
+                    "comments",
+                    lambda: comments_report.aggregate_comments(data["comments"].copy()),
+                    lambda: duckdb_backend.aggregate_comments(
+                        data["comments"], comments_report.PRIORITY, comments_report.CONTACTABLE
+                    ),
+                ),
+                compare(
+                    "tickets",
+                    lambda: tickets_data.latest_tickets(data["tickets"], TODAY),
+                    lambda: duckdb_backend.latest_tickets(data["tickets"], TODAY),
+                ),
+                compare(
+                    "app_login",
+                    lambda: app_login.latest_logins(data["logins"]),
+                    lambda: duckdb_backend.latest_logins(data["logins"]),
+                ),
+                compare(
+                    "ivr",
+                    lambda: ivr_data.build_output(
+                        pd.concat(
+                            [c for c in (ivr_data.daily_counts(ivr_data.read_ivr_file(f), f) for f in files) if c is not None],
+                            ignore_index=True,
+                        ),
+                        TODAY,
+                    ),
+                    lambda: ivr_data.pivot_counts(ivr_data.duckdb_month_counts(files, TODAY)),
+                ),
+            ]
+
+            alloc = pd.DataFrame({"customer_id": data["ids"].astype(str)})
+            write_parquet(alloc, os.path.join(tmp, compile_master.FILES["allocation"]))
+            write_parquet(comments_report.aggregate_comments(data["comments"].copy()),
+                          os.path.join(tmp, compile_master.FILES["comments"]))
+            write_parquet(tickets_data.latest_tickets(data["tickets"], TODAY), os.path.join(tmp, compile_master.FILES["tickets"]))
+            write_parquet(app_login.latest_logins(data["logins"]), os.path.join(tmp, compile_master.FILES["app_login"]))
+            out = os.path.join(tmp, "master_duckdb.parquet")
+            results.append(compare(
+                "compile_master",
+                compile_master.compile_in_memory,
+                lambda: (compile_master.compile_duckdb(out), pd.read_parquet(out))[1],
+            ))
+        finally:
+            paths.output_dir = previous_output_dir
+    return pd.DataFrame(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check pandas/DuckDB backend parity and time both on synthetic data")
+    parser.add_argument("--customers", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    try:
+        failed = False
+        for n in args.customers:
+            report = run(n)
+            report["speedup"] = report["pandas_s"] / report["duckdb_s"]
+            print(f"\n== {n:,} customers ==")
+            print(report.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+            failed = failed or not report["parity"].all()
+        sys.exit(1 if failed else 0)
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
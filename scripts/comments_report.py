@@ -1,11 +1,15 @@
 import os
 import sys
 from datetime import date
+from typing import Optional
 import pandas as pd
 
-from utils.config import paths
+from utils import duckdb_backend
+from utils.config import paths, execution
 from utils.logging_utils import get_logger
-from utils.db_utils import mysql_conn, run_query
+from utils.parquet_utils import write_parquet
+from utils.db_utils import fetch_chunks, mysql_conn, run_query
+from utils.memory_utils import SpillingAggregator, budget_for
 
 logger = get_logger("comments_report")
 
@@ -53,6 +57,11 @@ ORDER BY
     cc.create_date DESC;
 """
 
+COMMENT_COLUMNS = [
+    "customer_id", "collection_disposition", "collection_sub_disposition",
+    "collection_sub_disposition2", "callback_date", "ptp_date", "comment_date",
+]
+
 PRIORITY = [
     'Paid',
     'Part Payment Collected',
@@ -84,60 +93,103 @@ def priority_rank(value: str) -> int:
         return len(PRIORITY)
 
 
+def reduce_comments(df: pd.DataFrame, today: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Keep only rows that can still be picked by aggregate_comments, so chunks can be folded early.
+
+    Per customer: the latest comment, the latest one from yesterday, the most positive one and one
+    contactable one. Comment counts are not preserved and must be tracked separately.
+    """
+    today = (today or pd.Timestamp.today()).normalize()
+    yesterday = today - pd.Timedelta(days=1)
+    keyed = df.assign(
+        _date=pd.to_datetime(df["comment_date"], errors="coerce"),
+        _rank=df["collection_sub_disposition"].fillna(df["collection_disposition"]).apply(priority_rank),
+    )
+    y_mask = (keyed["_date"] >= yesterday) & (keyed["_date"] < today)
+    keep = (
+        keyed.sort_values("_date").groupby("customer_id").tail(1).index
+        .union(keyed[y_mask].sort_values("_date").groupby("customer_id").tail(1).index)
+        .union(keyed.sort_values(["customer_id", "_rank", "_date"]).groupby("customer_id").head(1).index)
+        .union(keyed[keyed["collection_sub_disposition"].isin(CONTACTABLE)].groupby("customer_id").head(1).index)
+    )
+    return df.loc[keep]
+
+
+def aggregate_comments(df: pd.DataFrame, today: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    df["customer_id"] = df["customer_id"].astype(str)
+    for c in ["callback_date", "ptp_date", "comment_date"]:
+        df[c] = pd.to_datetime(df[c], errors="coerce")
+
+    # Yesterday's comment (latest from yesterday)
+    today = (today or pd.Timestamp.today()).normalize()
+    yesterday = today - pd.Timedelta(days=1)
+    y_mask = (df["comment_date"] >= yesterday) & (df["comment_date"] < today)
+    y_df = df[y_mask].sort_values("comment_date").groupby("customer_id", as_index=False).tail(1)
+    y_df = y_df[["customer_id", "collection_disposition"]].rename(columns={"collection_disposition": "yesterday_comment"})
+
+    # MTD most positive comment by priority order across dispositions (disposition OR sub_disposition)
+    df["candidate"] = df["collection_sub_disposition"].fillna(df["collection_disposition"])
+    df["rank"] = df["candidate"].apply(priority_rank)
+    best = df.sort_values(["customer_id", "rank", "comment_date"]).groupby("customer_id", as_index=False).head(1)
+    best = best[["customer_id", "candidate"]].rename(columns={"candidate": "mtd_most_positive_comment"})
+
+    # Contactable vs NC - if any comment in CONTACTABLE
+    contact = df.assign(is_contactable=lambda d: d["collection_sub_disposition"].isin(CONTACTABLE)) \
+                .groupby("customer_id")["is_contactable"].any().rename("contactable")
+    contact = contact.reset_index()
+    contact["contactable_vs_nc"] = contact["contactable"].map({True: "Contactable", False: "NC"})
+
+    # Count of total comments this month
+    counts = df.groupby("customer_id").size().rename("mtd_comment_count").reset_index()
+
+    # Latest PTP and callback dates
+    latest_dates = df.sort_values("comment_date").groupby("customer_id", as_index=False).tail(1)
+    latest_dates = latest_dates[["customer_id", "ptp_date", "callback_date"]] \
+        .rename(columns={"ptp_date": "latest_ptp_date", "callback_date": "latest_callback_date"})
+
+    out = y_df.merge(best, on="customer_id", how="outer") \
+              .merge(contact[["customer_id", "contactable_vs_nc"]], on="customer_id", how="outer") \
+              .merge(counts, on="customer_id", how="outer") \
+              .merge(latest_dates, on="customer_id", how="outer")
+    return out
+
+
 def main():
     try:
         logger.info("Starting Comments report")
+        today = pd.Timestamp.today().normalize()
+        budget = budget_for("comments_report")
         with mysql_conn() as conn:
-            res = run_query(conn, SQL)
-            rows = res.fetchall()
-            logger.info("Fetched %d rows", len(rows))
-
-        if not rows:
+            res = run_query(conn, SQL, stream=True)
+            chunks = fetch_chunks(res, COMMENT_COLUMNS, budget)
+            if execution.backend == "duckdb":
+                # DuckDB takes the fetched chunks as they are and does all the grouping (and spilling) itself,
+                # counts included
+                out = duckdb_backend.aggregate_comments(chunks, PRIORITY, CONTACTABLE, today)
+            else:
+                candidates = SpillingAggregator(budget, lambda d: reduce_comments(d, today))
+                counts = SpillingAggregator(
+                    budget, lambda d: d.groupby("customer_id", as_index=False)["mtd_comment_count"].sum()
+                )
+                for chunk in chunks:
+                    candidates.add(reduce_comments(chunk, today))
+                    counts.add(chunk.groupby("customer_id").size().rename("mtd_comment_count").reset_index())
+                df = candidates.result()
+                if df.empty:
+                    out = df
+                else:
+                    out = aggregate_comments(df, today)
+                    # Candidate rows undercount comments; the count comes from the per-chunk totals
+                    totals = counts.result()
+                    totals = totals.set_index(totals["customer_id"].astype(str))["mtd_comment_count"]
+                    out["mtd_comment_count"] = out["customer_id"].map(totals)
+
+        if out.empty:
             out = pd.DataFrame(columns=[
                 "customer_id", "yesterday_comment", "mtd_most_positive_comment",
                 "contactable_vs_nc", "mtd_comment_count", "latest_ptp_date", "latest_callback_date"
             ])
         else:
-            df = pd.DataFrame(rows, columns=[
-                "customer_id","collection_disposition","collection_sub_disposition",
-                "collection_sub_disposition2","callback_date","ptp_date","comment_date"
-            ])
-            df["customer_id"] = df["customer_id"].astype(str)
-            for c in ["callback_date", "ptp_date", "comment_date"]:
-                df[c] = pd.to_datetime(df[c], errors="coerce")
-
-            # Yesterday's comment (latest from yesterday)
-            today = pd.Timestamp.today().normalize()
-            yesterday = today - pd.Timedelta(days=1)
-            y_mask = (df["comment_date"] >= yesterday) & (df["comment_date"] < today)
-            y_df = df[y_mask].sort_values("comment_date").groupby("customer_id", as_index=False).tail(1)
-            y_df = y_df[["customer_id", "collection_disposition"]].rename(columns={"collection_disposition": "yesterday_comment"})
-
-            # MTD most positive comment by priority order across dispositions (disposition OR sub_disposition)
-            df["candidate"] = df["collection_sub_disposition"].fillna(df["collection_disposition"])
-            df["rank"] = df["candidate"].apply(priority_rank)
-            best = df.sort_values(["customer_id", "rank", "comment_date"]).groupby("customer_id", as_index=False).head(1)
-            best = best[["customer_id", "candidate"]].rename(columns={"candidate": "mtd_most_positive_comment"})
-
-            # Contactable vs NC - if any comment in CONTACTABLE
-            contact = df.assign(is_contactable=lambda d: d["collection_sub_disposition"].isin(CONTACTABLE)) \
-                        .groupby("customer_id")["is_contactable"].any().rename("contactable")
-            contact = contact.reset_index()
-            contact["contactable_vs_nc"] = contact["contactable"].map({True: "Contactable", False: "NC"})
-
-            # Count of total comments this month
-            counts = df.groupby("customer_id").size().rename("mtd_comment_count").reset_index()
-
-            # Latest PTP and callback dates
-            latest_dates = df.sort_values("comment_date").groupby("customer_id", as_index=False).tail(1)
-            latest_dates = latest_dates[["customer_id", "ptp_date", "callback_date"]] \
-                .rename(columns={"ptp_date": "latest_ptp_date", "callback_date": "latest_callback_date"})
-
-            out = y_df.merge(best, on="customer_id", how="outer") \
-                      .merge(contact[["customer_id", "contactable_vs_nc"]], on="customer_id", how="outer") \
-                      .merge(counts, on="customer_id", how="outer") \
-                      .merge(latest_dates, on="customer_id", how="outer")
-
             # Align with allocation
             alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
             if os.path.exists(alloc_path):
@@ -145,7 +197,7 @@ def main():
                 out = alloc.merge(out, on="customer_id", how="left")
 
         output_path = os.path.join(paths.output_dir, "comments_report.parquet")
-        out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("Comments report completed successfully")
     except Exception as e:
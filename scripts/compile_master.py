@@ -1,12 +1,37 @@
+import math
 import os
 import sys
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-from utils.config import paths
+from utils import duckdb_backend
+from utils.config import paths, parquet, compile_cfg, execution
+from utils.delta_utils import export_delta
 from utils.logging_utils import get_logger
+from utils.master_lookup import build_lookup_index
+from utils.memory_utils import MemoryBudget, budget_for
+from utils.parquet_utils import (
+    PART_TEMPLATE,
+    atomic_parquet_writer,
+    customer_bucket,
+    parquet_files,
+    to_table,
+    write_parquet,
+)
 
 logger = get_logger("compile_master")
 
+# Decoded pandas frames plus merge copies run a few times the uncompressed Parquet size
+IN_MEMORY_OVERHEAD = 3
+
 FILES = {
     "allocation": "allocation_customer_ids.parquet",
     "app_login": "app_login.parquet",
@@ -16,6 +41,8 @@ FILES = {
     "ivr": "ivr_data.parquet",
 }
 
+MERGE_ORDER = ["app_login", "tickets", "payments", "comments", "ivr"]
+
 
 def load(name: str) -> pd.DataFrame:
     path = os.path.join(paths.output_dir, FILES[name])
@@ -30,28 +57,251 @@ def load(name: str) -> pd.DataFrame:
     return df
 
 
+def merge_stages(master: pd.DataFrame, stages: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    for key in MERGE_ORDER:
+        df = stages.get(key)
+        if df is None or df.empty:
+            logger.warning("Skipping missing/empty %s", key)
+            continue
+        # Avoid duplicate columns on merge
+        dupes = [c for c in df.columns if c != "customer_id" and c in master.columns]
+        df = df.drop(columns=dupes)
+        master = master.merge(df, on="customer_id", how="left")
+        logger.info("Merged %s; master now has %d rows and %d cols", key, master.shape[0], master.shape[1])
+    return master
+
+
+def compile_in_memory() -> pd.DataFrame:
+    alloc = load("allocation")
+    if alloc.empty:
+        logger.error("Allocation base is missing; cannot compile master")
+        sys.exit(1)
+    return merge_stages(alloc.copy(), {key: load(key) for key in MERGE_ORDER})
+
+
+# ---------------------------------------------------------------------------
+# Sharded compile: partition every stage by hash(customer_id), join bucket by bucket
+# ---------------------------------------------------------------------------
+
+def concrete_schema(schema: pa.Schema) -> pa.Schema:
+    # All-null columns (e.g. no comments yesterday) have Arrow type null; give them a real type so every
+    # bucket and build mode writes the same schema
+    return pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+
+
+def stage_schema(name: str) -> Optional[pa.Schema]:
+    files = parquet_files(os.path.join(paths.output_dir, FILES[name]))
+    if not files:
+        logger.warning("File missing: %s", os.path.join(paths.output_dir, FILES[name]))
+        return None
+    schema = pq.read_schema(files[0]).remove_metadata()
+    if "customer_id" not in schema.names:
+        logger.warning("customer_id missing in %s", name)
+        return None
+    # Empty stages are skipped like in the in-memory merge, so they add no columns
+    if not sum(pq.read_metadata(f).num_rows for f in files):
+        logger.warning("Skipping missing/empty %s", name)
+        return None
+    schema = schema.set(schema.get_field_index("customer_id"), pa.field("customer_id", pa.string()))
+    return concrete_schema(schema)
+
+
+def master_schema(schemas: Dict[str, pa.Schema]) -> pa.Schema:
+    fields = list(schemas["allocation"])
+    for key in MERGE_ORDER:
+        if key not in schemas:
+            continue
+        names = {f.name for f in fields}
+        fields.extend(f for f in schemas[key] if f.name != "customer_id" and f.name not in names)
+    return pa.schema(fields)
+
+
+def partition_stage(name: str, schema: pa.Schema, shards: int, workdir: str) -> None:
+    stage_dir = os.path.join(workdir, name)
+    os.makedirs(stage_dir)
+    writers = [pq.ParquetWriter(os.path.join(stage_dir, PART_TEMPLATE.format(b)), schema) for b in range(shards)]
+    rows = 0
+    try:
+        for fp in parquet_files(os.path.join(paths.output_dir, FILES[name])):
+            for batch in pq.ParquetFile(fp).iter_batches(batch_size=parquet.row_group_size):
+                ids = batch.column("customer_id").to_pandas().astype(str)
+                table = pa.Table.from_batches([batch])
+                table = table.set_column(
+                    table.schema.get_field_index("customer_id"), "customer_id", pa.array(ids, pa.string())
+                ).cast(schema)
+                bucket = customer_bucket(ids, shards)
+                for b in np.unique(bucket):
+                    writers[b].write_table(table.take(pa.array(np.flatnonzero(bucket == b))))
+                rows += table.num_rows
+    finally:
+        for w in writers:
+            w.close()
+    logger.info("Partitioned %s: %d rows into %d buckets", name, rows, shards)
+
+
+def compile_bucket(bucket: int, workdir: str, stages: List[str], schema: pa.Schema) -> int:
+    def read(name: str) -> pd.DataFrame:
+        return pd.read_parquet(os.path.join(workdir, name, PART_TEMPLATE.format(bucket)))
+
+    master = merge_stages(read("allocation"), {key: read(key) for key in stages})
+    master = master.sort_values("customer_id", kind="stable")
+    present = [f for f in schema if f.name in master.columns]
+    table = to_table(master[[f.name for f in present]], schema=pa.schema(present))
+    # Stages skipped as empty in this bucket still contribute their columns, as typed nulls
+    for i, field in enumerate(schema):
+        if field.name not in master.columns:
+            table = table.add_column(i, field, pa.nulls(len(table), field.type))
+    out = os.path.join(workdir, "master", PART_TEMPLATE.format(bucket))
+    pq.write_table(table, out)
+    return len(table)
+
+
+def merge_sorted_buckets(files: List[str], writer: pq.ParquetWriter, row_group_size: int) -> None:
+    """K-way merge bucket files, each sorted by customer_id, into globally sorted row groups.
+
+    Every bucket is read in small batches, so about one output row group is resident per round.
+    """
+    batch_size = max(1024, row_group_size // max(1, len(files)))
+    readers = [pq.ParquetFile(f).iter_batches(batch_size=batch_size) for f in files]
+    pending: List[Optional[pa.Table]] = [None] * len(files)
+
+    def refill(i: int) -> bool:
+        while pending[i] is None or not pending[i].num_rows:
+            batch = next(readers[i], None)
+            if batch is None:
+                return False
+            pending[i] = pa.Table.from_batches([batch])
+        return True
+
+    active = [i for i in range(len(files)) if refill(i)]
+    out = None
+    while active:
+        # No bucket can yield a key below the smallest last key among the buffered batches, so every
+        # row up to it is final
+        bound = min(pending[i].column("customer_id")[-1].as_py() for i in active)
+        taken = []
+        for i in active:
+            n = pc.sum(pc.less_equal(pending[i].column("customer_id"), bound)).as_py() or 0
+            taken.append(pending[i].slice(0, n))
+            pending[i] = pending[i].slice(n)
+        chunk = pa.concat_tables(taken).sort_by("customer_id")
+        out = chunk if out is None else pa.concat_tables([out, chunk])
+        while out.num_rows >= row_group_size:
+            writer.write_table(out.slice(0, row_group_size), row_group_size=row_group_size)
+            out = out.slice(row_group_size)
+        active = [i for i in active if refill(i)]
+    if out is not None and out.num_rows:
+        writer.write_table(out, row_group_size=row_group_size)
+
+
+def stage_schemas() -> Dict[str, pa.Schema]:
+    schemas = {}
+    for key in ["allocation"] + MERGE_ORDER:
+        schema = stage_schema(key)
+        if schema is not None:
+            schemas[key] = schema
+    return schemas
+
+
+def compile_sharded(output_path: str, shards: int, workers: int) -> int:
+    schemas = stage_schemas()
+    if "allocation" not in schemas:
+        logger.error("Allocation base is missing; cannot compile master")
+        sys.exit(1)
+    stages = [key for key in MERGE_ORDER if key in schemas]
+    schema = master_schema(schemas)
+
+    workdir = tempfile.mkdtemp(prefix=".compile_master-", dir=paths.output_dir)
+    try:
+        for key in ["allocation"] + stages:
+            partition_stage(key, schemas[key], shards, workdir)
+        os.makedirs(os.path.join(workdir, "master"))
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(compile_bucket, b, workdir, stages, schema) for b in range(shards)]
+                rows = sum(f.result() for f in futures)
+        else:
+            rows = sum(compile_bucket(b, workdir, stages, schema) for b in range(shards))
+
+        # Buckets are each sorted; merging them keeps the output sorted by customer_id, so row-group
+        # statistics stay selective like the in-memory build
+        with atomic_parquet_writer(output_path, schema) as writer:
+            merge_sorted_buckets(
+                [os.path.join(workdir, "master", PART_TEMPLATE.format(b)) for b in range(shards)],
+                writer,
+                compile_cfg.row_group_size,
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    logger.info("Sharded compile wrote %d rows from %d buckets", rows, shards)
+    return rows
+
+
+def compile_duckdb(output_path: str) -> None:
+    def stage_files(name: str) -> List[str]:
+        if stage_schema(name) is None:
+            return []
+        return parquet_files(os.path.join(paths.output_dir, FILES[name]))
+
+    alloc_files = stage_files("allocation")
+    if not alloc_files:
+        logger.error("Allocation base is missing; cannot compile master")
+        sys.exit(1)
+    stages = {}
+    for key in MERGE_ORDER:
+        files = stage_files(key)
+        if files:
+            stages[key] = files
+    duckdb_backend.compile_master(alloc_files, stages, output_path, compile_cfg.row_group_size)
+
+
+def estimated_bytes() -> int:
+    """Rough in-memory size of an unsharded compile: uncompressed stage bytes times pandas/merge overhead."""
+    total = 0
+    for name in FILES.values():
+        for f in parquet_files(os.path.join(paths.output_dir, name)):
+            meta = pq.ParquetFile(f).metadata
+            total += sum(meta.row_group(i).total_byte_size for i in range(meta.num_row_groups))
+    return total * IN_MEMORY_OVERHEAD
+
+
+def auto_shards(budget: MemoryBudget) -> int:
+    if not budget.enabled:
+        return 0
+    need = estimated_bytes()
+    if need <= budget.soft_limit:
+        return 0
+    return max(2, math.ceil(need / budget.soft_limit))
+
+
 def main():
     try:
         logger.info("Starting master compilation")
-        alloc = load("allocation")
-        if alloc.empty:
-            logger.error("Allocation base is missing; cannot compile master")
-            sys.exit(1)
-        master = alloc.copy()
-
-        for key in ["app_login", "tickets", "payments", "comments", "ivr"]:
-            df = load(key)
-            if df.empty:
-                logger.warning("Skipping missing/empty %s", key)
-                continue
-            # Avoid duplicate columns on merge
-            dupes = [c for c in df.columns if c != "customer_id" and c in master.columns]
-            df = df.drop(columns=dupes)
-            master = master.merge(df, on="customer_id", how="left")
-            logger.info("Merged %s; master now has %d rows and %d cols", key, master.shape[0], master.shape[1])
-
         output_path = os.path.join(paths.output_dir, "master_compiled.parquet")
-        master.to_parquet(output_path, index=False)
+        shards = compile_cfg.shards
+        workers = compile_cfg.workers
+        if execution.backend != "duckdb" and shards == 0:
+            shards = auto_shards(budget_for("compile_master"))
+            if shards:
+                # Buckets run one at a time so only a single bucket is resident within the budget
+                logger.info("Estimated size exceeds memory budget; switching to %d buckets", shards)
+                workers = 1
+        if execution.backend == "duckdb":
+            # DuckDB spills to disk on its own, so COMPILE_SHARDS does not apply
+            logger.info("DuckDB backend")
+            compile_duckdb(output_path)
+        elif shards > 0:
+            logger.info("Sharded mode: %d buckets, %d workers", shards, workers)
+            compile_sharded(output_path, shards, workers)
+        else:
+            master = compile_in_memory().sort_values("customer_id", kind="stable")
+            # Same schema as the sharded path (ints stay ints despite merge NaNs), so the mode never shows
+            table = to_table(master, schema=master_schema(stage_schemas()))
+            write_parquet(table, output_path, buckets=0, row_group_size=compile_cfg.row_group_size)
+        build_lookup_index(output_path)
+        if compile_cfg.delta_export:
+            export_delta(output_path, paths.output_dir)
         logger.info("Wrote master output: %s", output_path)
         logger.info("Master compilation completed successfully")
     except Exception as e:
@@ -1,19 +1,23 @@
 import os
+import re
 import sys
+import warnings
 from datetime import date
+from typing import Iterator, List, Optional, Tuple
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 
-from utils.config import paths
+from utils import duckdb_backend
+from utils.config import paths, execution, memory
 from utils.logging_utils import get_logger
+from utils.parquet_utils import write_parquet
 from utils.date_utils import month_date_range
+from utils.memory_utils import SpillingAggregator, budget_for
+from utils.schema_utils import IVR
 
 logger = get_logger("ivr_data")
 
-EXPECTED_COLS = [
-    "mobileNumber","CustomerID","campaignName","leadName","attemptNum","startDate","answerDate","endDate",
-    "callDuration","billSeconds","creditsUsed","disposition","hangupCause","hangupCode","clid","dtmfTime",
-    "voiceFileName","circle","operator","digitsPressed","circuitId","slaveId"
-]
+BUDGET = budget_for("ivr_data")
 
 
 def read_ivr_file(path: str) -> pd.DataFrame:
@@ -21,12 +25,220 @@ def read_ivr_file(path: str) -> pd.DataFrame:
     if ext in (".xlsx", ".xls"):
         df = pd.read_excel(path, engine="openpyxl")
     elif ext == ".csv":
-        df = pd.read_csv(path)
+        # As text, like the DuckDB scan: a blank CustomerID would otherwise turn the ids into floats
+        df = pd.read_csv(path, dtype=str)
     else:
         raise ValueError(f"Unsupported file extension: {ext}")
     return df
 
 
+def iter_ivr_chunks(path: str) -> Iterator[pd.DataFrame]:
+    if path.lower().endswith(".csv"):
+        # Stream large dumps instead of materializing the whole file; chunks shrink under memory pressure
+        size = memory.initial_chunk_rows
+        with pd.read_csv(path, dtype=str, chunksize=size) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(size)
+                except StopIteration:
+                    break
+                yield chunk
+                size = BUDGET.next_chunk_size(size)
+    else:
+        yield read_ivr_file(path)
+
+
+# Call date per row: prefer answerDate, else startDate, else endDate
+DATE_COLUMNS = ["answerDate", "startDate", "endDate"]
+
+# Format directives DuckDB's strptime reads exactly like pandas; %f takes a fixed width there and %z shifts to UTC
+DUCKDB_DATE_DIRECTIVES = {"%Y", "%m", "%d", "%H", "%M", "%S", "%I", "%p", "%b"}
+
+
+def normalize_customer_ids(s: pd.Series) -> pd.Series:
+    """Ids as stripped text without a float-style ".0" suffix; blanks become missing."""
+    ids = s.astype("string").str.strip().str.replace(r"\.0$", "", regex=True)
+    return ids.mask(ids.eq("")).astype(object)
+
+
+def call_date_format(s: pd.Series) -> Optional[str]:
+    """The format pd.to_datetime infers for `s`: guessed from its first value, "mixed" if that has none.
+
+    pandas then applies it to every value, so rows written differently come out NaT.
+    """
+    values = s.dropna()
+    if values.empty:
+        return None
+    first = values.iloc[0]
+    with warnings.catch_warnings():
+        # the dayfirst hint is for to_datetime callers; the guess itself is what pandas will use
+        warnings.simplefilter("ignore", UserWarning)
+        fmt = guess_datetime_format(first) if isinstance(first, str) else None
+    return fmt or "mixed"
+
+
+def duckdb_date_format(fmt: Optional[str]) -> bool:
+    """Whether DuckDB's try_strptime parses `fmt` the way pd.to_datetime does."""
+    return fmt not in (None, "mixed") and set(re.findall(r"%.", fmt)) <= DUCKDB_DATE_DIRECTIVES
+
+
+def parse_call_dates(s: pd.Series, fmt: Optional[str] = None) -> pd.Series:
+    """Call timestamps as pd.to_datetime infers them; values it cannot parse become NaT.
+
+    A chunk of a larger file passes the format inferred for the file, so it parses as the whole file would.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    return pd.to_datetime(s, format=fmt, errors="coerce")
+
+
+def ivr_columns(columns) -> Optional[Tuple[str, str, Optional[str]]]:
+    """Source names of the customer, call date and disposition columns; None if not an IVR dump."""
+    res = IVR.resolve(columns)
+    customer_col = res.source_of("CustomerID")
+    date_col = next((res.source_of(c) for c in DATE_COLUMNS if res.source_of(c) is not None), None)
+    if customer_col is None or date_col is None:
+        return None
+    return customer_col, date_col, res.source_of("disposition")
+
+
+def _ivr_calls(df: pd.DataFrame, cols: Tuple[str, str, Optional[str]],
+               date_format: Optional[str] = None) -> Tuple[pd.DataFrame, int]:
+    """Calls with a customer id and a parsed date, and how many were dropped for an unparseable date."""
+    customer_col, date_col, disposition_col = cols
+    calls = pd.DataFrame({
+        "customer_id": normalize_customer_ids(df[customer_col]),
+        "date_only": parse_call_dates(df[date_col], date_format).dt.date,
+        # CI = count where disposition == ANSWERED
+        "answered": df[disposition_col].astype(str).str.upper().eq("ANSWERED")
+        if disposition_col is not None else False,
+    }).dropna(subset=["customer_id"])
+    unparsed = int((calls["date_only"].isna() & df.loc[calls.index, date_col].notna()).sum())
+    return calls.dropna(subset=["date_only"]), unparsed
+
+
+def _log_unparsed(source: str, unparsed: int, total: int) -> None:
+    if unparsed:
+        logger.warning("%s: dropped %d of %d calls with an unparseable date", source or "IVR file", unparsed, total)
+
+
+def ivr_calls(df: pd.DataFrame, source: str = "") -> Optional[pd.DataFrame]:
+    """One row per call (customer_id, date_only, answered); None if not an IVR file."""
+    cols = ivr_columns(df.columns)
+    if cols is None:
+        logger.warning("CustomerID or call date column missing, not an IVR file")
+        return None
+    calls, unparsed = _ivr_calls(df, cols)
+    _log_unparsed(source, unparsed, len(calls) + unparsed)
+    return calls
+
+
+def _count(calls: pd.DataFrame) -> pd.DataFrame:
+    return (
+        calls.groupby(["customer_id", "date_only"])
+        .agg(AI=("answered", "size"), CI=("answered", "sum"))
+        .reset_index()
+    )
+
+
+def daily_counts(df: pd.DataFrame, source: str = "") -> Optional[pd.DataFrame]:
+    """Per customer/day AI (attempts) and CI (answered) counts for one IVR dump; None if not an IVR file."""
+    calls = ivr_calls(df, source)
+    if calls is None:
+        return None
+    return _count(calls)
+
+
+def iter_daily_counts(path: str) -> Iterator[pd.DataFrame]:
+    """daily_counts of each chunk of an IVR file, read lazily; yields nothing if it is not an IVR file.
+
+    Chunks can repeat a customer/day, so the caller reduces them with sum_counts.
+    """
+    date_format, unparsed, total = None, 0, 0
+    for chunk in iter_ivr_chunks(path):
+        cols = ivr_columns(chunk.columns)
+        if cols is None:
+            logger.warning("CustomerID or call date column missing in %s, not an IVR file", path)
+            return
+        # pandas infers one format for the whole column from its first value; keep it for later chunks
+        date_format = date_format or call_date_format(chunk[cols[1]])
+        calls, dropped = _ivr_calls(chunk, cols, date_format)
+        unparsed, total = unparsed + dropped, total + len(calls) + dropped
+        yield _count(calls)
+    _log_unparsed(path, unparsed, total)
+
+
+def sum_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    return counts.groupby(["customer_id", "date_only"], as_index=False)[["AI", "CI"]].sum()
+
+
+def duckdb_month_counts(files: List[str], today: Optional[date] = None) -> pd.DataFrame:
+    """Current-month customer/day AI and CI computed by DuckDB straight from the IVR dumps."""
+    month_days = month_date_range(today or date.today())
+    sources, frames = [], []
+    for fp in files:
+        try:
+            if fp.lower().endswith(".csv"):
+                head = pd.read_csv(fp, nrows=1000, dtype=str)
+                cols = ivr_columns(head.columns)
+                if cols is None:
+                    logger.warning("Skipping non-IVR file %s", fp)
+                    continue
+                fmt = call_date_format(head[cols[1]])
+                if duckdb_date_format(fmt):
+                    sources.append(duckdb_backend.CsvSource(fp, list(head.columns), *cols, fmt))
+                    continue
+                logger.info("%s: call dates written as %s, parsing them in pandas", fp, fmt)
+            # DuckDB has no Excel reader and cannot parse every date format pandas infers; these files are
+            # parsed in pandas and passed in as calls
+            calls = ivr_calls(read_ivr_file(fp), fp)
+            if calls is None:
+                logger.warning("Skipping non-IVR file %s", fp)
+                continue
+            frames.append(calls)
+        except Exception as e:
+            logger.exception("Failed reading IVR file %s: %s", fp, e)
+    return duckdb_backend.ivr_month_counts(sources, frames, month_days[0], month_days[-1])
+
+
+def build_output(counts: pd.DataFrame, today: Optional[date] = None) -> pd.DataFrame:
+    """Pivot daily counts (possibly from many files) into the stage output for the current month."""
+    # current month filter
+    month_days = month_date_range(today or date.today())
+    counts = counts[counts["date_only"].isin(month_days)]
+    return pivot_counts(sum_counts(counts))
+
+
+def pivot_counts(ai: pd.DataFrame) -> pd.DataFrame:
+    """Stage output from current-month customer/day AI and CI sums."""
+    if ai.empty:
+        logger.warning("No IVR data found")
+        return pd.DataFrame(columns=["customer_id"])  # will add daily AI/CI later if present
+    ci = ai[ai["CI"] > 0]
+
+    # Pivot to columns per date with suffixes
+    ai_pivot = ai.pivot(index="customer_id", columns="date_only", values="AI").fillna(0).astype(int)
+    ci_pivot = ci.pivot(index="customer_id", columns="date_only", values="CI").fillna(0).astype(int)
+
+    # Rename columns with suffix
+    ai_pivot.columns = [f"{d.isoformat()}_AI" for d in ai_pivot.columns]
+    ci_pivot.columns = [f"{d.isoformat()}_CI" for d in ci_pivot.columns]
+
+    # Combine and compute MTD sums
+    out = ai_pivot.join(ci_pivot, how="outer").reset_index()
+    ai_cols = [c for c in out.columns if c.endswith("_AI")]
+    ci_cols = [c for c in out.columns if c.endswith("_CI")]
+    out["MTD_AI"] = out[ai_cols].sum(axis=1)
+    out["MTD_CI"] = out[ci_cols].sum(axis=1)
+
+    # Align with allocation
+    alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
+    if os.path.exists(alloc_path):
+        alloc = pd.read_parquet(alloc_path)
+        out = alloc.merge(out, left_on="customer_id", right_on="customer_id", how="left")
+    return out
+
+
 def main():
     try:
         logger.info("Starting IVR data aggregation")
@@ -42,85 +254,28 @@ def main():
         ]
         logger.info("Found %d IVR files", len(files))
 
-        frames = []
-        for fp in files:
-            try:
-                df = read_ivr_file(fp)
-                # standardize columns if possible
-                lower_map = {c.lower(): c for c in df.columns}
-                for c in EXPECTED_COLS:
-                    if c not in df.columns and c.lower() in lower_map:
-                        df.rename(columns={lower_map[c.lower()]: c}, inplace=True)
-                # filter to current month rows via startDate or answerDate
-                for dc in ["startDate", "answerDate", "endDate"]:
-                    if dc in df.columns:
-                        df[dc] = pd.to_datetime(df[dc], errors="coerce")
-                frames.append(df)
-            except Exception as e:
-                logger.exception("Failed reading IVR file %s: %s", fp, e)
-
-        if not frames:
-            logger.warning("No IVR data found")
-            out = pd.DataFrame(columns=["customer_id"])  # will add daily AI/CI later if present
+        if execution.backend == "duckdb":
+            # DuckDB scans the CSV dumps itself; only the month's customer/day counts come back to pandas
+            out = pivot_counts(duckdb_month_counts(files))
         else:
-            allv = pd.concat(frames, ignore_index=True)
-            if "CustomerID" not in allv.columns:
-                logger.error("CustomerID column missing in IVR files")
-                sys.exit(2)
-            allv["customer_id"] = allv["CustomerID"].astype(str).str.strip()
-
-            # Determine date per row: prefer answerDate, else startDate
-            date_col = None
-            if "answerDate" in allv.columns:
-                date_col = "answerDate"
-            elif "startDate" in allv.columns:
-                date_col = "startDate"
-            elif "endDate" in allv.columns:
-                date_col = "endDate"
-            
-            if date_col is None:
-                logger.error("No date column found in IVR data")
-                sys.exit(3)
-
-            allv["date_only"] = pd.to_datetime(allv[date_col], errors="coerce").dt.date
-
-            # current month filter
-            month_start = date(date.today().year, date.today().month, 1)
-            month_days = month_date_range(date.today())
-            allv = allv[allv["date_only"].isin(month_days)]
-
-            # AI = count of rows per customer_id per date
-            ai = allv.groupby(["customer_id", "date_only"]).size().rename("AI").reset_index()
-            # CI = count where disposition == ANSWERED
-            if "disposition" in allv.columns:
-                ci = allv[allv["disposition"].astype(str).str.upper().eq("ANSWERED")] \
-                        .groupby(["customer_id", "date_only"]).size().rename("CI").reset_index()
-            else:
-                ci = ai.assign(CI=0)[["customer_id", "date_only", "CI"]].copy()
-
-            # Pivot to columns per date with suffixes
-            ai_pivot = ai.pivot(index="customer_id", columns="date_only", values="AI").fillna(0).astype(int)
-            ci_pivot = ci.pivot(index="customer_id", columns="date_only", values="CI").fillna(0).astype(int)
+            # Reduce each chunk to daily counts as it is read instead of concatenating raw calls
+            partials = SpillingAggregator(BUDGET, sum_counts)
+            for fp in files:
+                try:
+                    for counts in iter_daily_counts(fp):
+                        partials.add(counts)
+                except Exception as e:
+                    logger.exception("Failed reading IVR file %s: %s", fp, e)
 
-            # Rename columns with suffix
-            ai_pivot.columns = [f"{d.isoformat()}_AI" for d in ai_pivot.columns]
-            ci_pivot.columns = [f"{d.isoformat()}_CI" for d in ci_pivot.columns]
-
-            # Combine and compute MTD sums
-            out = ai_pivot.join(ci_pivot, how="outer").reset_index()
-            ai_cols = [c for c in out.columns if c.endswith("_AI")]
-            ci_cols = [c for c in out.columns if c.endswith("_CI")]
-            out["MTD_AI"] = out[ai_cols].sum(axis=1)
-            out["MTD_CI"] = out[ci_cols].sum(axis=1)
-
-            # Align with allocation
-            alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
-            if os.path.exists(alloc_path):
-                alloc = pd.read_parquet(alloc_path)
-                out = alloc.merge(out, left_on="customer_id", right_on="customer_id", how="left")
+            counts = partials.result()
+            if counts.empty:
+                logger.warning("No IVR data found")
+                out = pd.DataFrame(columns=["customer_id"])  # will add daily AI/CI later if present
+            else:
+                out = build_output(counts)
 
         output_path = os.path.join(paths.output_dir, "ivr_data.parquet")
-        out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("IVR data aggregation completed successfully")
     except Exception as e:
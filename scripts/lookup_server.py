@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from utils.config import paths, lookup_cfg
+from utils.logging_utils import get_logger
+from utils.master_lookup import MasterLookup
+
+logger = get_logger("lookup_server")
+
+
+def make_handler(lookup: MasterLookup):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body) -> None:
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            # GET /customers/<id>  or  GET /customers?id=a&id=b
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts[:1] != ["customers"]:
+                self._send(404, {"error": "not found"})
+            elif len(parts) == 2:
+                row = lookup.get(unquote(parts[1]))
+                if row is None:
+                    self._send(404, {"error": "unknown customer_id"})
+                else:
+                    self._send(200, row)
+            else:
+                ids = parse_qs(url.query).get("id", [])
+                rows = lookup.get_many(ids).astype(object)
+                self._send(200, rows.where(rows.notna(), None).to_dict(orient="records"))
+
+        def log_message(self, fmt, *args):
+            logger.debug(fmt, *args)
+
+    return Handler
+
+
+def main():
+    try:
+        path = os.path.join(paths.output_dir, "master_compiled.parquet")
+        if not os.path.exists(path):
+            logger.error("Master file not found: %s", path)
+            sys.exit(1)
+        lookup = MasterLookup(path, cache_row_groups=lookup_cfg.cache_row_groups)
+        server = ThreadingHTTPServer((lookup_cfg.host, lookup_cfg.port), make_handler(lookup))
+        logger.info("Serving customer lookups on http://%s:%d", lookup_cfg.host, lookup_cfg.port)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Lookup server stopped")
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
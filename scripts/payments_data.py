@@ -1,29 +1,19 @@
 import os
 import sys
 from datetime import date
+from typing import Iterable, Iterator, Optional
 import pandas as pd
-import numpy as np
 
-from utils.config import paths
+from utils.config import paths, payments_cfg
 from utils.logging_utils import get_logger
+from utils.memory_utils import budget_for
+from utils.parquet_utils import write_parquet
+from utils.payments_ledger import LEDGER_COLUMNS, PaymentsLedger
+from utils.schema_utils import PAYMENTS
 
 logger = get_logger("payments_data")
 
-EXPECTED_COLS = {
-    "customer_id": "customer_id",
-    "amt_payment": "amt_payment",
-    "DATE(op.create_date)": "create_date",
-    "transaction_id": "transaction_id",
-    "mode": "mode",
-    "MONTHNAME(create_date)": "month_name",
-    "YEAR(create_date)": "year",
-    "presentation_status": "presentation_status",
-    "bounce_reason": "bounce_reason",
-    "payment_channel": "payment_channel",
-    "payment_from_customer": "payment_from_customer",
-    "DATE(op.received_date)": "received_date",
-    "remarks": "remarks",
-}
+BUDGET = budget_for("payments_data")
 
 
 def read_payment_file(path: str) -> pd.DataFrame:
@@ -38,21 +28,74 @@ def read_payment_file(path: str) -> pd.DataFrame:
 
 
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    colmap = {}
-    lower_cols = {c.lower(): c for c in df.columns}
-    for raw, norm in EXPECTED_COLS.items():
-        key = raw.lower()
-        if key in lower_cols:
-            colmap[lower_cols[key]] = norm
-        else:
-            # try simplified names
-            simplified = raw.lower().replace("(op.", "(").replace("date(", "").replace(")", "")
-            for c in df.columns:
-                if simplified in c.lower().replace(" ", ""):
-                    colmap[c] = norm
+    return PAYMENTS.apply(df)
+
+
+def iter_payment_chunks(path: str) -> Iterator[pd.DataFrame]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        # Stream large CSV exports instead of materializing the whole file; chunks shrink under memory pressure
+        size = payments_cfg.csv_chunksize
+        with pd.read_csv(path, chunksize=size) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(size)
+                except StopIteration:
                     break
-    df = df.rename(columns=colmap)
-    return df
+                yield chunk
+                size = BUDGET.next_chunk_size(size)
+    else:
+        yield read_payment_file(path)
+
+
+def payment_frame(df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    """Ledger columns of a raw payments frame, or None if it is not a payments export."""
+    if PAYMENTS.missing(df.columns):
+        return None
+    df = normalize_columns(df)
+    return df[[c for c in LEDGER_COLUMNS if c in df.columns]]
+
+
+def parse_payment_file(path: str) -> Iterator[pd.DataFrame]:
+    """Ledger frames per chunk, read lazily; yields nothing if the file is not a payments export."""
+    logger.info("Reading payments file: %s", path)
+    for df in iter_payment_chunks(path):
+        df = payment_frame(df)
+        if df is None:
+            logger.warning("customer_id/amt_payment columns missing in %s, skipping", path)
+            return
+        yield df
+
+
+def ledger_path() -> str:
+    return paths.payments_ledger or os.path.join(paths.output_dir, "payments_ledger.sqlite")
+
+
+def ingest(ledger: PaymentsLedger, path: str, chunks: Iterable[pd.DataFrame]) -> int:
+    # Each chunk is applied as soon as it is read; the file only counts as ingested once all of it is in.
+    # A file that yields no chunks is not a payments export and is recorded as "other", so the watcher
+    # still reads it (e.g. IVR dumps sharing the folder).
+    occurrences = {}
+    new_rows, is_payments = 0, False
+    for chunk in chunks:
+        is_payments = True
+        new_rows += ledger.apply(chunk, path, occurrences)
+    ledger.mark_ingested(path, new_rows, "payments" if is_payments else "other")
+    return new_rows
+
+
+def build_output(ledger: PaymentsLedger, month_start: Optional[date] = None) -> pd.DataFrame:
+    out = ledger.current_month(month_start)
+    if out.empty:
+        logger.warning("No valid payments data found")
+        return pd.DataFrame(columns=["customer_id", "sum_paid_this_month", "latest_payment_date", "payment_count_this_month"])
+
+    # Align with allocation
+    alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
+    if os.path.exists(alloc_path):
+        alloc = pd.read_parquet(alloc_path)
+        out = alloc.merge(out, on="customer_id", how="left")
+    return out
 
 
 def main():
@@ -73,66 +116,22 @@ def main():
         ]
         logger.info("Found %d payment files", len(files))
 
-        frames = []
-        for fp in files:
-            try:
-                logger.info("Reading payments file: %s", fp)
-                df = read_payment_file(fp)
-                df = normalize_columns(df)
-                if "customer_id" not in df.columns:
-                    logger.warning("customer_id column missing in %s, skipping", fp)
-                    continue
-                # parse dates
-                for c in ["create_date", "received_date"]:
-                    if c in df.columns:
-                        df[c] = pd.to_datetime(df[c], errors="coerce").dt.date
-                frames.append(df)
-            except Exception as e:
-                logger.exception("Failed to read %s: %s", fp, e)
-
-        if not frames:
-            logger.warning("No valid payments data found")
-            out = pd.DataFrame(columns=["customer_id", "sum_paid_this_month", "latest_payment_date", "payment_count_this_month"])
-        else:
-            allp = pd.concat(frames, ignore_index=True)
-            allp["customer_id"] = allp["customer_id"].astype(str).str.strip()
-
-            # Filter to current month based on create_date or received_date
-            def is_current_month(d: date) -> bool:
-                return d is not None and d >= month_start and d <= date.today()
-
-            current_mask = False
-            if "create_date" in allp.columns:
-                current_mask = current_mask | allp["create_date"].apply(lambda d: is_current_month(d))
-            if "received_date" in allp.columns:
-                current_mask = current_mask | allp["received_date"].apply(lambda d: is_current_month(d))
-
-            current = allp[current_mask] if isinstance(current_mask, pd.Series) else allp.iloc[0:0]
-
-            sums = current.groupby("customer_id")["amt_payment"].sum(min_count=1).rename("sum_paid_this_month")
-            counts = current.groupby("customer_id").size().rename("payment_count_this_month")
-
-            # latest payment date overall
-            date_cols = [c for c in ["create_date", "received_date"] if c in allp.columns]
-            if date_cols:
-                allp["latest_payment_date"] = allp[date_cols].apply(lambda row: max([d for d in row if pd.notna(d)]), axis=1)
-                latest = allp.sort_values("latest_payment_date").groupby("customer_id", as_index=False).tail(1)
-                latest = latest[["customer_id", "latest_payment_date"]]
-            else:
-                latest = pd.DataFrame(columns=["customer_id", "latest_payment_date"])            
-
-            out = (
-                latest.set_index("customer_id").join(sums, how="outer").join(counts, how="outer").reset_index()
-            )
-
-            # Align with allocation
-            alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
-            if os.path.exists(alloc_path):
-                alloc = pd.read_parquet(alloc_path)
-                out = alloc.merge(out, on="customer_id", how="left")
+        with PaymentsLedger(ledger_path()) as ledger:
+            pending = [fp for fp in files if not ledger.is_ingested(fp)]
+            logger.info("%d new or changed payment files to ingest into %s", len(pending), ledger.path)
+
+            # Files are streamed one at a time, so only the current chunk is held in memory. A file that
+            # fails midway is not marked ingested; the ledger skips its already-applied rows on retry.
+            for fp in pending:
+                try:
+                    ingest(ledger, fp, parse_payment_file(fp))
+                except Exception as e:
+                    logger.exception("Failed to ingest %s: %s", fp, e)
+
+            out = build_output(ledger, month_start)
 
         output_path = os.path.join(paths.output_dir, "payments_data.parquet")
-        out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("Payments aggregation completed successfully")
     except Exception as e:
@@ -1,12 +1,16 @@
 import os
 import sys
 from datetime import date, datetime
+from typing import Optional
 import pandas as pd
 
-from utils.config import paths
+from utils import duckdb_backend
+from utils.config import paths, execution
 from utils.logging_utils import get_logger
-from utils.db_utils import mysql_conn, run_query
+from utils.parquet_utils import write_parquet
+from utils.db_utils import fetch_chunks, mysql_conn, run_query
 from utils.date_utils import months_between, bucket_months
+from utils.memory_utils import SpillingAggregator, budget_for
 
 logger = get_logger("tickets_data")
 
@@ -16,30 +20,47 @@ from ts_tickets tt
 where date(create_date) > '2024-01-01';
 """
 
+TICKET_COLUMNS = ["user_id", "source", "create_date"]
+
+
+def reduce_latest(df: pd.DataFrame) -> pd.DataFrame:
+    # Only each user's latest ticket can matter, so chunks are reduced before they accumulate
+    return df.sort_values("create_date").groupby("user_id", as_index=False).tail(1)
+
+
+def latest_tickets(df: pd.DataFrame, today: Optional[date] = None) -> pd.DataFrame:
+    df = df.assign(customer_id=lambda d: d["user_id"].astype(str))
+    df["create_date"] = pd.to_datetime(df["create_date"]).dt.date
+
+    latest = df.sort_values("create_date").groupby("customer_id", as_index=False).tail(1)
+    today = today or date.today()
+    latest["months_old"] = latest["create_date"].apply(lambda d: months_between(d, today))
+    latest["latest_ticket_recency_bucket"] = latest["months_old"].apply(bucket_months)
+    latest = latest.rename(columns={"source": "latest_ticket_source"})
+    return latest[["customer_id", "latest_ticket_source", "latest_ticket_recency_bucket"]]
+
 
 def main():
     try:
         logger.info("Starting Tickets Data extraction")
+        budget = budget_for("tickets_data")
         with mysql_conn() as conn:
-            res = run_query(conn, SQL)
-            rows = res.fetchall()
-            logger.info("Fetched %d rows", len(rows))
+            res = run_query(conn, SQL, stream=True)
+            chunks = fetch_chunks(res, TICKET_COLUMNS, budget)
+            if execution.backend == "duckdb":
+                # DuckDB takes the fetched chunks as they are and does all the grouping (and spilling) itself
+                out = duckdb_backend.latest_tickets(chunks)
+            else:
+                partials = SpillingAggregator(budget, reduce_latest)
+                for chunk in chunks:
+                    partials.add(reduce_latest(chunk))
+                df = partials.result()
+                out = df if df.empty else latest_tickets(df)
 
-        if not rows:
+        if out.empty:
             logger.warning("No tickets returned")
             out = pd.DataFrame(columns=["customer_id", "latest_ticket_source", "latest_ticket_recency_bucket"])
         else:
-            df = pd.DataFrame(rows, columns=["user_id", "source", "create_date"]) \
-                .assign(customer_id=lambda d: d["user_id"].astype(str))
-            df["create_date"] = pd.to_datetime(df["create_date"]).dt.date
-
-            latest = df.sort_values("create_date").groupby("customer_id", as_index=False).tail(1)
-            today = date.today()
-            latest["months_old"] = latest["create_date"].apply(lambda d: months_between(d, today))
-            latest["latest_ticket_recency_bucket"] = latest["months_old"].apply(bucket_months)
-            latest = latest.rename(columns={"source": "latest_ticket_source"})
-            out = latest[["customer_id", "latest_ticket_source", "latest_ticket_recency_bucket"]]
-
             # Align with allocation if present
             alloc_path = os.path.join(paths.output_dir, "allocation_customer_ids.parquet")
             if os.path.exists(alloc_path):
@@ -47,7 +68,7 @@ def main():
                 out = alloc.merge(out, on="customer_id", how="left")
 
         output_path = os.path.join(paths.output_dir, "tickets_data.parquet")
-        out.to_parquet(output_path, index=False)
+        write_parquet(out, output_path)
         logger.info("Wrote output: %s", output_path)
         logger.info("Tickets Data extraction completed successfully")
     except Exception as e:
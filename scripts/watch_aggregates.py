@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+from typing import Dict
+
+import pandas as pd
+
+from utils.config import paths, watch_cfg
+from utils.logging_utils import get_logger
+from utils.memory_utils import SpillingAggregator
+from utils.parquet_utils import write_parquet
+from utils.payments_ledger import PaymentsLedger
+from utils.schema_utils import PAYMENTS
+from utils.watch_utils import FolderWatcher
+from scripts import ivr_data, payments_data
+
+logger = get_logger("watch_aggregates")
+
+SUPPORTED_EXTS = (".csv", ".xlsx", ".xls")
+
+
+def read_header(path: str) -> list:
+    if path.lower().endswith(".csv"):
+        return list(pd.read_csv(path, nrows=0).columns)
+    return list(pd.read_excel(path, engine="openpyxl", nrows=0).columns)
+
+
+class LiveAggregates:
+    """Payments go through the dedup ledger; IVR daily counts are kept in memory per source file."""
+
+    def __init__(self, ledger: PaymentsLedger):
+        self.ledger = ledger
+        self.ivr_counts: Dict[str, pd.DataFrame] = {}
+        # Write both outputs once after the initial scan
+        self.payments_dirty = True
+        self.ivr_dirty = True
+
+    def apply_file(self, path: str) -> None:
+        if not path.lower().endswith(SUPPORTED_EXTS):
+            return
+        # Payments exports already applied (e.g. before a restart or by the nightly job) are skipped without
+        # parsing. IVR counts live in memory and are always re-read.
+        if self.ledger.is_ingested(path, kind="payments"):
+            logger.info("Payments file %s already in the ledger, skipping", path)
+            return
+        # Each kind is read by its batch job's reader, so both produce the same customer ids
+        header = read_header(path)
+        if not PAYMENTS.missing(header):
+            new_rows = payments_data.ingest(self.ledger, path, payments_data.parse_payment_file(path))
+            self.payments_dirty = self.payments_dirty or new_rows > 0
+            return
+
+        if ivr_data.ivr_columns(header) is not None:
+            partials = SpillingAggregator(ivr_data.BUDGET, ivr_data.sum_counts)
+            for chunk_counts in ivr_data.iter_daily_counts(path):
+                partials.add(chunk_counts)
+            counts = partials.result()
+            # A changed file replaces its previous contribution rather than adding to it
+            if counts.empty:
+                self.ivr_counts.pop(path, None)
+            else:
+                self.ivr_counts[path] = counts
+            self.ivr_dirty = True
+            logger.info("IVR: %d customer-days from %s", len(counts), path)
+            return
+        logger.warning("Ignoring %s: neither a payments nor an IVR file", path)
+
+    def remove_file(self, path: str) -> None:
+        # Ledger transactions are kept; only the in-memory IVR contribution is dropped
+        if self.ivr_counts.pop(path, None) is not None:
+            self.ivr_dirty = True
+
+    def checkpoint(self) -> None:
+        if self.payments_dirty:
+            write_parquet(payments_data.build_output(self.ledger), os.path.join(paths.output_dir, "payments_data.parquet"))
+            self.payments_dirty = False
+        if self.ivr_dirty:
+            if self.ivr_counts:
+                out = ivr_data.build_output(pd.concat(self.ivr_counts.values(), ignore_index=True))
+            else:
+                out = pd.DataFrame(columns=["customer_id"])
+            write_parquet(out, os.path.join(paths.output_dir, "ivr_data.parquet"))
+            self.ivr_dirty = False
+
+
+def main():
+    try:
+        logger.info("Starting payments/IVR watcher")
+        drop_dir = paths.payments_dir
+        if not os.path.isdir(drop_dir):
+            logger.error("Drop dir not found: %s", drop_dir)
+            sys.exit(1)
+
+        with PaymentsLedger(payments_data.ledger_path()) as ledger, \
+                FolderWatcher(drop_dir, watch_cfg.poll_interval, watch_cfg.use_inotify) as watcher:
+            live = LiveAggregates(ledger)
+            last_checkpoint = 0.0
+            try:
+                while True:
+                    changed, removed = watcher.changes()
+                    for fp in changed:
+                        try:
+                            live.apply_file(fp)
+                        except Exception as e:
+                            logger.exception("Failed to apply %s: %s", fp, e)
+                    for fp in removed:
+                        live.remove_file(fp)
+
+                    if time.monotonic() - last_checkpoint >= watch_cfg.checkpoint_interval:
+                        live.checkpoint()
+                        last_checkpoint = time.monotonic()
+            finally:
+                # Flush updates applied since the last checkpoint (e.g. on Ctrl-C) before the ledger closes
+                live.checkpoint()
+    except KeyboardInterrupt:
+        logger.info("Watcher stopped")
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
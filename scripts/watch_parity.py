@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+from utils.config import paths
+from utils.logging_utils import get_logger
+from utils.payments_ledger import PaymentsLedger
+from scripts import ivr_data, payments_data
+from scripts.watch_aggregates import LiveAggregates
+
+logger = get_logger("watch_parity")
+
+OUTPUTS = ["payments_data.parquet", "ivr_data.parquet"]
+
+
+def write_drop_folder(folder: str) -> None:
+    """A payments export and an IVR dump side by side, with leading-zero ids the readers must keep as text."""
+    day = date.today().replace(day=1).isoformat()
+    pd.DataFrame({
+        "customer_id": ["00101", "00102", "00101"],
+        "amt_payment": [100, 250, 100],
+        "create_date": [day, day, day],
+    }).to_csv(os.path.join(folder, "pay.csv"), index=False)
+    pd.DataFrame({
+        "CustomerID": ["00101", "00101", "00103", ""],
+        "startDate": [f"{day} 10:00:00", f"{day} 11:00:00", f"{day} 12:00:00", f"{day} 13:00:00"],
+        "disposition": ["ANSWERED", "BUSY", "ANSWERED", "ANSWERED"],
+    }).to_csv(os.path.join(folder, "ivr.csv"), index=False)
+
+
+def run() -> bool:
+    """Run the nightly payments and IVR jobs, then the watcher on the same ledger; outputs must match."""
+    previous = (paths.output_dir, paths.payments_dir, paths.payments_ledger)
+    with tempfile.TemporaryDirectory() as tmp:
+        drop, batch_out, watch_out = (os.path.join(tmp, d) for d in ("drop", "batch", "watch"))
+        for d in (drop, batch_out, watch_out):
+            os.makedirs(d)
+        write_drop_folder(drop)
+        paths.payments_dir = drop
+        paths.payments_ledger = os.path.join(tmp, "payments_ledger.sqlite")
+        try:
+            paths.output_dir = batch_out
+            payments_data.main()
+            ivr_data.main()
+
+            paths.output_dir = watch_out
+            with PaymentsLedger(payments_data.ledger_path()) as ledger:
+                live = LiveAggregates(ledger)
+                for f in sorted(os.listdir(drop)):
+                    live.apply_file(os.path.join(drop, f))
+                live.checkpoint()
+        finally:
+            paths.output_dir, paths.payments_dir, paths.payments_ledger = previous
+
+        ok = True
+        for name in OUTPUTS:
+            batch = pd.read_parquet(os.path.join(batch_out, name)).sort_values("customer_id").reset_index(drop=True)
+            watch = pd.read_parquet(os.path.join(watch_out, name)).sort_values("customer_id").reset_index(drop=True)
+            try:
+                pd.testing.assert_frame_equal(batch, watch, check_dtype=False)
+                logger.info("%s: batch and watcher agree on %d rows", name, len(batch))
+            except AssertionError as e:
+                ok = False
+                logger.error("%s: batch and watcher differ\n%s", name, e)
+        return ok
+
+
+def main():
+    try:
+        sys.exit(0 if run() else 1)
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        sys.exit(3)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,8 @@ class Paths:
         "PAYMENTS_DIR", "/Users/rishabhmadaan/Documents/Collections/Oct Payment"
     )
     output_dir: str = _env("OUTPUT_DIR", os.path.join(os.getcwd(), "output"))
+    # Defaults to <output_dir>/payments_ledger.sqlite
+    payments_ledger: Optional[str] = _env("PAYMENTS_LEDGER")
 
 
 @dataclass
@@ -32,6 +34,15 @@ class RedshiftConfig:
     user: str = _env("REDSHIFT_USER", "")
     password: str = _env("REDSHIFT_PASSWORD", "")
     sslmode: str = _env("REDSHIFT_SSLMODE", "require")
+    # "cursor" fetches through the leader node; "unload" exports Parquet to unload_location
+    export_mode: str = _env("REDSHIFT_EXPORT_MODE", "cursor")
+    unload_location: str = _env("REDSHIFT_UNLOAD_LOCATION", "")
+    unload_iam_role: str = _env("REDSHIFT_UNLOAD_IAM_ROLE", "")
+    # S3-compatible endpoint (e.g. http://localhost:9000) when not reading from AWS S3
+    s3_endpoint: str = _env("S3_ENDPOINT_URL", "")
+    unload_read_workers: int = int(_env("REDSHIFT_UNLOAD_READ_WORKERS", "8"))
+    # Delete each run's unloaded prefix once it has been read; set to 0 to keep extracts for debugging
+    unload_cleanup: bool = _env("REDSHIFT_UNLOAD_CLEANUP", "1") == "1"
 
 
 @dataclass
@@ -50,9 +61,81 @@ class RunWindow:
     end_date: date = date.today()
 
 
+@dataclass
+class ParquetConfig:
+    compression: str = _env("PARQUET_COMPRESSION", "zstd")
+    compression_level: int = int(_env("PARQUET_COMPRESSION_LEVEL", "3"))
+    row_group_size: int = int(_env("PARQUET_ROW_GROUP_SIZE", "131072"))
+    # String columns with distinct/rows at or below this ratio get dictionary encoding
+    dictionary_max_ratio: float = float(_env("PARQUET_DICTIONARY_MAX_RATIO", "0.1"))
+    # 0 = single file per stage; N > 0 = N hash(customer_id) shards per stage
+    hash_buckets: int = int(_env("PARQUET_HASH_BUCKETS", "0"))
+
+
+@dataclass
+class PaymentsConfig:
+    csv_chunksize: int = int(_env("PAYMENTS_CSV_CHUNKSIZE", "200000"))
+
+
+@dataclass
+class WatchConfig:
+    poll_interval: float = float(_env("WATCH_POLL_INTERVAL", "2"))
+    checkpoint_interval: float = float(_env("WATCH_CHECKPOINT_INTERVAL", "30"))
+    # Set to 0 to force the polling fallback
+    use_inotify: bool = _env("WATCH_USE_INOTIFY", "1") == "1"
+
+
+@dataclass
+class CompileConfig:
+    # 0 = in-memory compile; N > 0 = hash-partition every stage into N buckets and join per bucket
+    shards: int = int(_env("COMPILE_SHARDS", "0"))
+    workers: int = int(_env("COMPILE_WORKERS", "1"))
+    # Smaller row groups keep single-customer lookups cheap
+    row_group_size: int = int(_env("COMPILE_ROW_GROUP_SIZE", "16384"))
+    # Write a changeset of inserted/changed/removed customers against the previous build
+    delta_export: bool = _env("COMPILE_DELTA_EXPORT", "0") == "1"
+
+
+@dataclass
+class ExecutionConfig:
+    # "pandas" or "duckdb"
+    backend: str = _env("EXECUTION_BACKEND", "pandas")
+    duckdb_threads: int = int(_env("DUCKDB_THREADS", "0"))  # 0 = all cores
+    duckdb_memory_limit: str = _env("DUCKDB_MEMORY_LIMIT", "")  # e.g. "4GB"; empty = DuckDB default
+    duckdb_temp_dir: str = _env("DUCKDB_TEMP_DIR", "")  # spill location; empty = DuckDB default
+
+
+@dataclass
+class MemoryConfig:
+    # Per-stage RSS budget; <STAGE>_MEMORY_MB (e.g. COMMENTS_REPORT_MEMORY_MB) overrides. 0 = unlimited
+    stage_memory_mb: int = int(_env("STAGE_MEMORY_MB", "0"))
+    # Shrink chunks once RSS passes this fraction of the budget
+    soft_fraction: float = float(_env("MEMORY_SOFT_FRACTION", "0.8"))
+    # Share of the budget a stage's in-memory partial aggregates may take before they are folded or spilled
+    spill_fraction: float = float(_env("MEMORY_SPILL_FRACTION", "0.25"))
+    initial_chunk_rows: int = int(_env("CHUNK_ROWS_INITIAL", "100000"))
+    min_chunk_rows: int = int(_env("CHUNK_ROWS_MIN", "5000"))
+    max_chunk_rows: int = int(_env("CHUNK_ROWS_MAX", "1000000"))
+    spill_dir: str = _env("SPILL_DIR", "")  # empty = <output_dir>
+
+
+@dataclass
+class LookupConfig:
+    host: str = _env("LOOKUP_HOST", "127.0.0.1")
+    port: int = int(_env("LOOKUP_PORT", "8765"))
+    cache_row_groups: int = int(_env("LOOKUP_CACHE_ROW_GROUPS", "64"))
+
+
 paths = Paths()
 redshift = RedshiftConfig()
 mysql = MySQLConfig()
 run_window = RunWindow()
+parquet = ParquetConfig()
+compile_cfg = CompileConfig()
+payments_cfg = PaymentsConfig()
+watch_cfg = WatchConfig()
+lookup_cfg = LookupConfig()
+execution = ExecutionConfig()
+memory = MemoryConfig()
 
 os.makedirs(paths.output_dir, exist_ok=True)
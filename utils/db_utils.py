@@ -1,10 +1,22 @@
-from typing import Optional
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 from contextlib import contextmanager
 
-from utils.config import redshift, mysql
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs as pafs
+
+from utils.config import redshift, mysql, memory
 from utils.logging_utils import get_logger
+from utils.memory_utils import MemoryBudget
 
 logger = get_logger("db_utils")
 
@@ -48,6 +60,108 @@ def mysql_conn() -> Engine:
         engine.dispose()
 
 
-def run_query(conn, sql: str, params: Optional[dict] = None):
+def run_query(conn, sql: str, params: Optional[dict] = None, stream: bool = False):
     logger.info("Running query...")
+    if stream:
+        # Server-side cursor so fetchmany() pulls rows incrementally instead of buffering the result
+        conn = conn.execution_options(stream_results=True)
     return conn.execute(text(sql), params or {})
+
+
+def fetch_chunks(result, columns: List[str], budget: MemoryBudget) -> Iterator[pd.DataFrame]:
+    """Yield result rows as DataFrames, resizing each fetch to the stage's memory budget."""
+    size = memory.initial_chunk_rows
+    total = 0
+    while True:
+        rows = result.fetchmany(size)
+        if not rows:
+            break
+        total += len(rows)
+        yield pd.DataFrame(rows, columns=columns)
+        size = budget.next_chunk_size(size)
+    logger.info("Fetched %d rows", total)
+
+
+def _sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render_sql(sql: str, params: Optional[dict] = None) -> str:
+    # UNLOAD takes its query as a string literal, so :name binds are inlined as quoted literals
+    params = params or {}
+    return re.sub(r"(?<![:\w]):(\w+)", lambda m: _sql_literal(params[m.group(1)]), sql)
+
+
+def unload_to_parquet(conn, sql: str, params: Optional[dict] = None, label: str = "extract",
+                      location: Optional[str] = None) -> str:
+    """Run `sql` as a Redshift UNLOAD ... FORMAT AS PARQUET into a fresh prefix and return that prefix."""
+    location = (location or redshift.unload_location).rstrip("/")
+    if not location.startswith("s3://"):
+        raise RuntimeError("UNLOAD needs an s3:// location. Set REDSHIFT_UNLOAD_LOCATION.")
+    if not redshift.unload_iam_role:
+        raise RuntimeError("UNLOAD needs an IAM role. Set REDSHIFT_UNLOAD_IAM_ROLE.")
+    prefix = f"{location}/{label}/{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}/"
+    query = render_sql(sql, params).strip().rstrip(";")
+    stmt = (
+        f"UNLOAD ({_sql_literal(query)}) TO {_sql_literal(prefix)} "
+        f"IAM_ROLE {_sql_literal(redshift.unload_iam_role)} FORMAT AS PARQUET"
+    )
+    logger.info("Unloading %s to %s", label, prefix)
+    # Driver-level execution: the statement is fully rendered and must not be re-parsed for binds
+    conn.exec_driver_sql(stmt)
+    return prefix
+
+
+def _staging_filesystem(location: str) -> Tuple[pafs.FileSystem, str]:
+    if location.startswith("s3://"):
+        if redshift.s3_endpoint:
+            endpoint = urlparse(redshift.s3_endpoint)
+            fs = pafs.S3FileSystem(endpoint_override=endpoint.netloc or endpoint.path, scheme=endpoint.scheme or "https")
+        else:
+            fs = pafs.S3FileSystem()
+        return fs, location[len("s3://"):].rstrip("/")
+    return pafs.LocalFileSystem(), os.path.abspath(location)
+
+
+def read_unloaded_parquet(location: str, max_workers: Optional[int] = None) -> pa.Table:
+    """Read every Parquet part under an UNLOAD prefix (s3:// or a local directory) in parallel.
+
+    The location is never modified; callers delete prefixes they created with `delete_unloaded`.
+    """
+    fs, root = _staging_filesystem(location)
+    infos = fs.get_file_info(pafs.FileSelector(root, recursive=True, allow_not_found=True))
+    files = sorted(
+        i.path for i in infos
+        if i.type == pafs.FileType.File and i.size
+        and not os.path.basename(i.path).startswith((".", "_"))
+        and not i.path.endswith("manifest")
+    )
+    logger.info("Reading %d unloaded Parquet parts from %s", len(files), location)
+    if not files:
+        table = pa.table({})
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers or redshift.unload_read_workers) as pool:
+            tables = list(pool.map(lambda p: pq.read_table(p, filesystem=fs), files))
+        table = pa.concat_tables(tables, promote_options="default")
+    return table
+
+
+def delete_unloaded(location: str) -> None:
+    """Delete a prefix returned by `unload_to_parquet`; only call it on prefixes this run created."""
+    fs, root = _staging_filesystem(location)
+    # The data is already in memory, so a failed delete only leaves staging files behind
+    try:
+        fs.delete_dir(root)
+        logger.info("Deleted unloaded prefix %s", location)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("Could not delete unloaded prefix %s: %s", location, e)
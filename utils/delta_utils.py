@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.logging_utils import get_logger
+from utils.parquet_utils import atomic_parquet_writer, write_parquet
+
+logger = get_logger("delta_utils")
+
+HASHES_FILE = "master_hashes.parquet"
+CHANGE_COL = "_change"
+# Bumped whenever row_hashes changes; a baseline from another version triggers one full refresh
+HASH_VERSION = "2"
+
+# Integer/bool columns convert to float/object only in row groups that contain a null, which changes
+# their hashes; pandas' nullable dtypes keep one representation (and the same hash) either way
+_NULLABLE_DTYPES = {
+    pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(), pa.uint16(): pd.UInt16Dtype(), pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(), pa.bool_(): pd.BooleanDtype(),
+}
+
+
+def _name_key(name: str) -> np.uint64:
+    return np.frombuffer(hashlib.sha1(name.encode()).digest()[:8], dtype=np.uint64)[0]
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Per-row hash that ignores null values, so adding or dropping an all-null column keeps it unchanged.
+
+    Each non-null cell contributes a mixed hash of (column name, value); contributions are summed, which
+    makes the result independent of column order. Rows are compared over the union of old and new
+    columns with absent columns treated as null.
+    """
+    out = np.zeros(len(df), dtype=np.uint64)
+    for name in df.columns:
+        col = df[name]
+        values = pd.util.hash_pandas_object(col, index=False).to_numpy()
+        mixed = pd.util.hash_array(values ^ _name_key(str(name)))
+        out += np.where(col.notna().to_numpy(), mixed, np.uint64(0))
+    return out
+
+
+def column_types(schema: pa.Schema) -> Dict[str, str]:
+    return {f.name: str(f.type) for f in schema}
+
+
+def schema_fingerprint(schema: pa.Schema) -> str:
+    desc = ";".join(f"{f.name}:{f.type}" for f in schema)
+    return hashlib.sha1(desc.encode()).hexdigest()
+
+
+def _load_previous(path: str):
+    if not os.path.exists(path):
+        return None, None
+    table = pq.read_table(path)
+    meta = table.schema.metadata or {}
+    prev = table.to_pandas()
+    if prev["customer_id"].duplicated().any():
+        logger.warning("Duplicate customer_ids in previous hashes; keeping the last row per customer")
+        prev = prev.drop_duplicates("customer_id", keep="last")
+    if meta.get(b"hash_version", b"").decode() != HASH_VERSION:
+        types = None
+    else:
+        types = json.loads(meta.get(b"column_types", b"{}"))
+    return prev.set_index("customer_id")["row_hash"].astype("UInt64"), types
+
+
+def _write_json(obj: dict, path: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(obj, fh, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def export_delta(master_path: str, output_dir: str, delta_dir: Optional[str] = None) -> dict:
+    """Write inserted/changed/removed customer rows of `master_path` relative to the previous build.
+
+    Previous builds are represented only by their (customer_id, row_hash) pairs, so no full copy of the
+    old master is kept. New or dropped columns (e.g. a new day of IVR counts) only mark the customers
+    whose values differ; a column changing type forces a full refresh. The changeset is streamed row
+    group by row group into Parquet next to a JSON manifest, which is returned.
+    """
+    delta_dir = delta_dir or os.path.join(output_dir, "deltas")
+    os.makedirs(delta_dir, exist_ok=True)
+    hashes_path = os.path.join(output_dir, HASHES_FILE)
+    prev, prev_types = _load_previous(hashes_path)
+
+    pf = pq.ParquetFile(master_path)
+    schema = pf.schema_arrow.remove_metadata()
+    fingerprint = schema_fingerprint(schema)
+    types = column_types(schema)
+    if prev is not None and prev_types is None:
+        retyped = ["*"]
+        logger.warning("Previous hashes use another hash version; every customer is emitted as changed")
+    else:
+        prev_types = prev_types or {}
+        retyped = sorted(c for c in types if c in prev_types and prev_types[c] != types[c])
+        if prev is not None and retyped:
+            logger.warning("Column types changed since last build (%s); every customer is emitted as changed",
+                           ", ".join(retyped))
+    full_refresh = prev is None or bool(retyped)
+
+    now = datetime.now()
+    # Sub-second stamp plus a random suffix, so back-to-back builds never overwrite each other's changeset
+    stamp = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    changeset_path = os.path.join(delta_dir, f"master_delta_{stamp}.parquet")
+    out_schema = schema.append(pa.field(CHANGE_COL, pa.string()))
+
+    counts = {"insert": 0, "update": 0, "delete": 0}
+    new_ids, new_hashes = [], []
+    with atomic_parquet_writer(changeset_path, out_schema) as writer:
+        for rg in range(pf.metadata.num_row_groups):
+            table = pf.read_row_group(rg).replace_schema_metadata(None)
+            df = table.to_pandas(types_mapper=_NULLABLE_DTYPES.get)
+            h = row_hashes(df)
+            ids = df["customer_id"].astype(str)
+            new_ids.append(ids.to_numpy())
+            new_hashes.append(h)
+
+            if prev is None:
+                kind = np.full(len(df), "insert", dtype=object)
+            else:
+                old = prev.reindex(ids)
+                is_new = old.isna().to_numpy()
+                differs = old.fillna(0).to_numpy(dtype=np.uint64) != h
+                kind = np.where(is_new, "insert", np.where(differs | full_refresh, "update", ""))
+            mask = kind != ""
+            if mask.any():
+                part = table.filter(pa.array(mask)).append_column(CHANGE_COL, pa.array(kind[mask], pa.string()))
+                writer.write_table(part.cast(out_schema))
+                for k in ("insert", "update"):
+                    counts[k] += int((kind == k).sum())
+            del df, table
+
+        all_ids = pd.Index(np.concatenate(new_ids) if new_ids else np.array([], dtype=object))
+        if prev is not None:
+            removed = prev.index.difference(all_ids)
+            if len(removed):
+                columns = {f.name: pa.nulls(len(removed), f.type) for f in out_schema}
+                columns["customer_id"] = pa.array(removed.astype(str), pa.string()).cast(schema.field("customer_id").type)
+                columns[CHANGE_COL] = pa.array(["delete"] * len(removed), pa.string())
+                writer.write_table(pa.table(columns, schema=out_schema))
+                counts["delete"] = len(removed)
+
+    manifest = {
+        "created_at": now.isoformat(timespec="milliseconds"),
+        "master_path": master_path,
+        "master_rows": pf.metadata.num_rows,
+        "changeset": os.path.basename(changeset_path),
+        "full_refresh": full_refresh,
+        "schema_fingerprint": fingerprint,
+        "added_columns": sorted(set(types) - set(prev_types or {})) if prev is not None else [],
+        "removed_columns": sorted(set(prev_types or {}) - set(types)) if prev is not None else [],
+        "inserted": counts["insert"],
+        "changed": counts["update"],
+        "removed": counts["delete"],
+    }
+    _write_json(manifest, os.path.join(delta_dir, f"master_delta_{stamp}.json"))
+
+    # Baseline is only advanced once the changeset and manifest are on disk
+    hashes = pa.table({
+        "customer_id": pa.array(all_ids.astype(str), pa.string()),
+        "row_hash": np.concatenate(new_hashes) if new_hashes else np.array([], dtype=np.uint64),
+    }).replace_schema_metadata({
+        "schema_fingerprint": fingerprint,
+        "column_types": json.dumps(types),
+        "hash_version": HASH_VERSION,
+    })
+    write_parquet(hashes, hashes_path, buckets=0)
+    logger.info(
+        "Delta export: %d inserted, %d changed, %d removed -> %s",
+        counts["insert"], counts["update"], counts["delete"], changeset_path,
+    )
+    return manifest
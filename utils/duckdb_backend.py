@@ -0,0 +1,273 @@
+# DuckDB versions of the stage aggregations (EXECUTION_BACKEND=duckdb). Each mirrors the pandas function
+# in its script; duckdb is optional and only imported when this backend is selected.
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.config import execution
+from utils.logging_utils import get_logger
+from utils.parquet_utils import atomic_path
+
+logger = get_logger("duckdb_backend")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+@contextmanager
+def connect():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise RuntimeError("EXECUTION_BACKEND=duckdb requires the duckdb package (pip install duckdb)") from e
+    con = duckdb.connect()
+    try:
+        if execution.duckdb_threads:
+            con.execute(f"SET threads = {int(execution.duckdb_threads)}")
+        if execution.duckdb_memory_limit:
+            con.execute(f"SET memory_limit = {_literal(execution.duckdb_memory_limit)}")
+        if execution.duckdb_temp_dir:
+            con.execute(f"SET temp_directory = {_literal(execution.duckdb_temp_dir)}")
+        yield con
+    finally:
+        con.close()
+
+
+# A stage's rows: one frame, or the chunks fetched from its database cursor
+Source = Union[pd.DataFrame, Iterable[pd.DataFrame]]
+
+
+def _batches(chunks: Iterable[pd.DataFrame]) -> Optional[pa.RecordBatchReader]:
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return None
+    head = pa.Table.from_pandas(first, preserve_index=False).replace_schema_metadata(None)
+    # Columns that are all null in the first chunk get a concrete type; the SQL TRY_CASTs them as needed
+    schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in head.schema])
+
+    def gen():
+        yield from head.cast(schema).to_batches()
+        for chunk in chunks:
+            yield from pa.Table.from_pandas(chunk, preserve_index=False).select(schema.names).cast(schema).to_batches()
+
+    return pa.RecordBatchReader.from_batches(schema, gen())
+
+
+def _load(con, name: str, source: Source) -> bool:
+    """Expose `source` to `con` as table `name`; False when it is a stream that yielded nothing.
+
+    Fetched chunks are copied into a DuckDB table as they arrive, so the rows live in DuckDB (which
+    spills past DUCKDB_MEMORY_LIMIT) rather than in pandas, and queries may scan them more than once.
+    """
+    if isinstance(source, pd.DataFrame):
+        con.register(name, source)
+        return True
+    reader = _batches(source)
+    if reader is None:
+        return False
+    con.register(f"{name}_stream", reader)
+    con.execute(f"CREATE TABLE {_quote(name)} AS SELECT * FROM {_quote(name + '_stream')}")
+    con.unregister(f"{name}_stream")
+    return True
+
+
+COMMENTS_SQL = """
+WITH c AS (
+    SELECT
+        CAST(customer_id AS VARCHAR) AS customer_id,
+        collection_disposition,
+        collection_sub_disposition,
+        TRY_CAST(callback_date AS TIMESTAMP) AS callback_date,
+        TRY_CAST(ptp_date AS TIMESTAMP) AS ptp_date,
+        TRY_CAST(comment_date AS TIMESTAMP) AS comment_date,
+        COALESCE(collection_sub_disposition, collection_disposition) AS candidate,
+        collection_sub_disposition IN (SELECT name FROM contactable) AS is_contactable
+    FROM comments
+), ranked AS (
+    SELECT c.*, COALESCE(p.priority_rank, {n_priority}) AS priority_rank
+    FROM c LEFT JOIN priority p ON p.name = c.candidate
+), best AS (
+    SELECT customer_id, candidate AS mtd_most_positive_comment
+    FROM ranked
+    QUALIFY row_number() OVER (PARTITION BY customer_id ORDER BY priority_rank, comment_date NULLS LAST) = 1
+), agg AS (
+    SELECT
+        customer_id,
+        arg_max_null(collection_disposition, comment_date)
+            FILTER (WHERE comment_date >= $yesterday AND comment_date < $today) AS yesterday_comment,
+        CASE WHEN bool_or(is_contactable) THEN 'Contactable' ELSE 'NC' END AS contactable_vs_nc,
+        count(*) AS mtd_comment_count,
+        arg_max_null(ptp_date, comment_date) AS latest_ptp_date,
+        arg_max_null(callback_date, comment_date) AS latest_callback_date
+    FROM c
+    GROUP BY customer_id
+)
+SELECT agg.customer_id, yesterday_comment, mtd_most_positive_comment, contactable_vs_nc,
+       mtd_comment_count, latest_ptp_date, latest_callback_date
+FROM agg JOIN best USING (customer_id)
+"""
+
+
+def aggregate_comments(source: Source, priority: List[str], contactable: Iterable[str],
+                       today: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    today = (today or pd.Timestamp.today()).normalize()
+    with connect() as con:
+        if not _load(con, "comments", source):
+            return pd.DataFrame()
+        con.register("priority", pd.DataFrame({"name": priority, "priority_rank": range(len(priority))}))
+        con.register("contactable", pd.DataFrame({"name": sorted(contactable)}))
+        return con.execute(
+            COMMENTS_SQL.format(n_priority=len(priority)),
+            {"today": today.to_pydatetime(), "yesterday": (today - pd.Timedelta(days=1)).to_pydatetime()},
+        ).df()
+
+
+TICKETS_SQL = """
+WITH latest AS (
+    SELECT
+        CAST(user_id AS VARCHAR) AS customer_id,
+        arg_max_null(source, CAST(create_date AS DATE)) AS latest_ticket_source,
+        max(CAST(create_date AS DATE)) AS create_date
+    FROM tickets
+    GROUP BY 1
+)
+SELECT
+    customer_id,
+    latest_ticket_source,
+    CASE
+        WHEN create_date IS NULL THEN '>12 months'
+        WHEN abs(date_diff('month', create_date, $today)) <= 1 THEN '<=1 month'
+        WHEN abs(date_diff('month', create_date, $today)) <= 3 THEN '1-3 months'
+        WHEN abs(date_diff('month', create_date, $today)) <= 6 THEN '3-6 months'
+        WHEN abs(date_diff('month', create_date, $today)) <= 12 THEN '6-12 months'
+        ELSE '>12 months'
+    END AS latest_ticket_recency_bucket
+FROM latest
+"""
+
+
+def latest_tickets(source: Source, today: Optional[date] = None) -> pd.DataFrame:
+    with connect() as con:
+        if not _load(con, "tickets", source):
+            return pd.DataFrame()
+        return con.execute(TICKETS_SQL, {"today": today or date.today()}).df()
+
+
+def latest_logins(source: Source) -> pd.DataFrame:
+    with connect() as con:
+        if not _load(con, "logins", source):
+            return pd.DataFrame()
+        return con.execute(
+            "SELECT CAST(customer_id AS VARCHAR) AS customer_id, max(create_date) AS latest_login_date, "
+            "'Yes' AS app_login FROM logins GROUP BY 1"
+        ).df()
+
+
+class CsvSource(NamedTuple):
+    """An IVR CSV dump, the source names of its header and the columns the aggregation needs, and the
+    format its call dates are written in."""
+    path: str
+    columns: List[str]
+    customer_col: str
+    date_col: str
+    disposition_col: Optional[str]
+    date_format: str
+
+
+def _read_csv(source: CsvSource) -> str:
+    # The header is already known, so skip DuckDB's dialect/type sniffing (most of the cost on small files)
+    columns = "{" + ", ".join(f"{_literal(c)}: 'VARCHAR'" for c in source.columns) + "}"
+    return (
+        f"read_csv({_literal(source.path)}, header = true, auto_detect = false, "
+        f"delim = ',', quote = '\"', escape = '\"', columns = {columns})"
+    )
+
+
+def ivr_month_counts(sources: List[CsvSource], frames: List[pd.DataFrame], start: date, end: date) -> pd.DataFrame:
+    """Per customer/day AI (calls) and CI (answered) for calls dated within [start, end].
+
+    `sources` are IVR CSV dumps scanned directly by DuckDB; `frames` are calls (customer_id, date_only,
+    answered) already parsed from inputs DuckDB cannot read, such as Excel. Ids and dates are cleaned as
+    in ivr_data.ivr_calls: a trailing ".0" is dropped, blank ids are skipped and a date must match the
+    source's format exactly, surrounding whitespace included, as pd.to_datetime requires.
+    """
+    parts = []
+    for i, src in enumerate(sources):
+        disposition = src.disposition_col
+        answered = f"coalesce(upper({_quote(disposition)}) = 'ANSWERED', false)" if disposition else "false"
+        raw = _quote(src.date_col)
+        parts.append(
+            f"SELECT {i} AS source, nullif(regexp_replace(trim({_quote(src.customer_col)}), '\\.0$', ''), '') "
+            f"AS customer_id, CAST(CASE WHEN NOT regexp_matches({raw}, '^\\s|\\s$') "
+            f"THEN try_strptime({raw}, {_literal(src.date_format)}) END AS DATE) AS date_only, "
+            f"{raw} IS NOT NULL AS dated, {answered} AS answered FROM {_read_csv(src)}"
+        )
+    with connect() as con:
+        for i, frame in enumerate(frames):
+            con.register(f"calls_{i}", frame)
+            parts.append(
+                "SELECT NULL AS source, customer_id, CAST(date_only AS DATE) AS date_only, true AS dated, answered "
+                f"FROM calls_{i}"
+            )
+        if not parts:
+            return pd.DataFrame(columns=["customer_id", "date_only", "AI", "CI"])
+        # One scan yields both the counts and, per source, the calls dropped for a date that did not parse
+        out = con.execute(
+            "SELECT source, customer_id, date_only, count(*) AS AI, "
+            "CAST(sum(CAST(answered AS INTEGER)) AS BIGINT) AS CI, "
+            "count(*) FILTER (WHERE date_only IS NULL) AS unparsed, GROUPING(source) = 0 AS per_source "
+            f"FROM ({' UNION ALL '.join(parts)}) "
+            "WHERE customer_id IS NOT NULL AND (date_only BETWEEN $start AND $end OR date_only IS NULL AND dated) "
+            "GROUP BY GROUPING SETS ((customer_id, date_only), (source)) "
+            "HAVING CASE WHEN GROUPING(source) = 0 THEN source IS NOT NULL AND unparsed > 0 "
+            "ELSE date_only IS NOT NULL END",
+            {"start": start, "end": end},
+        ).df()
+    dropped = out[out["per_source"]]
+    for src_index, unparsed in zip(dropped["source"], dropped["unparsed"]):
+        logger.warning("%s: dropped %d calls with an unparseable date", sources[int(src_index)].path, unparsed)
+    out = out[~out["per_source"]][["customer_id", "date_only", "AI", "CI"]]
+    out["date_only"] = pd.to_datetime(out["date_only"]).dt.date
+    return out.reset_index(drop=True)
+
+
+def compile_master(alloc_files: List[str], stages: Dict[str, List[str]], output_path: str,
+                   row_group_size: int) -> None:
+    """Left-join every stage onto the allocation in DuckDB and COPY the result straight to Parquet.
+
+    `stages` is ordered; a column already present in the master is not taken again from later stages.
+    """
+    def relation(files: List[str]) -> str:
+        file_list = "[" + ", ".join(_literal(f) for f in files) + "]"
+        return (
+            "(SELECT * REPLACE (CAST(customer_id AS VARCHAR) AS customer_id) "
+            f"FROM read_parquet({file_list}, union_by_name = true))"
+        )
+
+    with connect() as con:
+        seen = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {relation(alloc_files)}").fetchall()]
+        select = [f"a.{_quote(c)}" for c in seen]
+        joins = []
+        for i, (name, files) in enumerate(stages.items()):
+            cols = [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM {relation(files)}").fetchall()]
+            keep = [c for c in cols if c != "customer_id" and c not in seen]
+            seen.extend(keep)
+            select.extend(f"s{i}.{_quote(c)}" for c in keep)
+            joins.append(f"LEFT JOIN {relation(files)} s{i} ON s{i}.customer_id = a.customer_id")
+            logger.info("Joining %s (%d new columns)", name, len(keep))
+
+        sql = f"SELECT {', '.join(select)} FROM {relation(alloc_files)} a {' '.join(joins)} ORDER BY a.customer_id"
+        with atomic_path(output_path) as tmp:
+            con.execute(
+                f"COPY ({sql}) TO {_literal(tmp)} "
+                f"(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {int(row_group_size)})"
+            )
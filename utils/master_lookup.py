@@ -0,0 +1,174 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.logging_utils import get_logger
+from utils.parquet_utils import write_parquet
+
+logger = get_logger("master_lookup")
+
+
+def index_path_for(path: str) -> str:
+    root, _ = os.path.splitext(path)
+    return f"{root}.idx.parquet"
+
+
+def master_fingerprint(data: pa.Buffer) -> str:
+    """Hash of a Parquet file's footer (offsets, statistics, row counts), which differs between builds."""
+    footer_len = int.from_bytes(data[-8:-4].to_pybytes(), "little")
+    return hashlib.sha256(data[-(footer_len + 8):].to_pybytes()).hexdigest()
+
+
+def build_lookup_index(path: str) -> str:
+    """Write a customer_id -> (row group, offset) index next to a master Parquet file."""
+    pf = pq.ParquetFile(path)
+    ids, groups, offsets = [], [], []
+    for rg in range(pf.metadata.num_row_groups):
+        col = pf.read_row_group(rg, columns=["customer_id"]).column("customer_id")
+        ids.append(col.cast(pa.string()))
+        groups.append(np.full(len(col), rg, dtype=np.int32))
+        offsets.append(np.arange(len(col), dtype=np.int32))
+    index = pa.table({
+        "customer_id": pa.chunked_array(ids, type=pa.string()) if ids else pa.array([], pa.string()),
+        "row_group": np.concatenate(groups) if groups else np.array([], dtype=np.int32),
+        "offset": np.concatenate(offsets) if offsets else np.array([], dtype=np.int32),
+    })
+    index = index.sort_by("customer_id").replace_schema_metadata({
+        "master_num_rows": str(pf.metadata.num_rows),
+        "master_num_row_groups": str(pf.metadata.num_row_groups),
+        "master_fingerprint": master_fingerprint(pa.memory_map(path).read_buffer()),
+    })
+    out = index_path_for(path)
+    write_parquet(index, out, buckets=0)
+    logger.info("Wrote lookup index for %d customers: %s", index.num_rows, out)
+    return out
+
+
+def _file_id(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class _Snapshot:
+    """One master build: its mapped bytes, parsed footer, index arrays and row-group cache."""
+
+    def __init__(self, path: str, index_path: str):
+        self.file_id = _file_id(path)
+        # One mapping for the life of the snapshot: it keeps reading the build it was opened on even
+        # after compile_master replaces the path
+        self.buffer = pa.memory_map(path).read_buffer()
+        self.file = pq.ParquetFile(pa.BufferReader(self.buffer))
+        index = pq.read_table(index_path, memory_map=True)
+        meta = index.schema.metadata or {}
+        if meta.get(b"master_fingerprint", b"").decode() != master_fingerprint(self.buffer):
+            raise RuntimeError(f"Lookup index is stale for {path}; rerun compile_master")
+        self.ids = np.asarray(index.column("customer_id").to_pylist(), dtype=str)
+        self.row_group = index.column("row_group").to_numpy()
+        self.offset = index.column("offset").to_numpy()
+        self.cache: "OrderedDict[int, pa.Table]" = OrderedDict()
+        self.local = threading.local()
+
+    def thread_file(self) -> pq.ParquetFile:
+        # Readers are not shared across threads; each reads the snapshot's buffer with the parsed footer
+        pf = getattr(self.local, "file", None)
+        if pf is None:
+            pf = self.local.file = pq.ParquetFile(pa.BufferReader(self.buffer), metadata=self.file.metadata)
+        return pf
+
+
+class MasterLookup:
+    """Single and batched customer lookups against master_compiled.parquet without loading it.
+
+    The index lives in memory as sorted numpy arrays; the master is memory-mapped and only the row
+    groups holding requested customers are decoded, with the most recent ones kept in an LRU cache.
+    A rebuilt master is picked up once its matching index has been written; until then the previous
+    build keeps serving from its own mapping.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None, cache_row_groups: int = 16):
+        self.path = path
+        self.index_path = index_path or index_path_for(path)
+        self._cache_size = cache_row_groups
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot(path, self.index_path)
+        self._failed_reload = None
+
+    @property
+    def file(self) -> pq.ParquetFile:
+        return self._snapshot.file
+
+    def _current(self) -> _Snapshot:
+        snap = self._snapshot
+        try:
+            files = (_file_id(self.path), _file_id(self.index_path))
+        except FileNotFoundError:
+            # Mid-swap or removed; keep serving the mapped build
+            return snap
+        if files[0] == snap.file_id or files == self._failed_reload:
+            return snap
+        with self._lock:
+            if self._snapshot is not snap:
+                return self._snapshot
+            try:
+                self._snapshot = _Snapshot(self.path, self.index_path)
+                logger.info("Reloaded rebuilt master %s", self.path)
+            except (OSError, RuntimeError) as e:
+                # The index is written after the master; retry once either file changes again
+                self._failed_reload = files
+                logger.warning("Master %s changed but could not be reloaded yet: %s", self.path, e)
+            return self._snapshot
+
+    def _read_row_group(self, snap: _Snapshot, rg: int) -> pa.Table:
+        with self._lock:
+            table = snap.cache.get(rg)
+            if table is not None:
+                snap.cache.move_to_end(rg)
+                return table
+        # Decode outside the lock so a cache miss does not stall lookups served from the cache
+        table = snap.thread_file().read_row_group(rg)
+        with self._lock:
+            snap.cache[rg] = table
+            snap.cache.move_to_end(rg)
+            if len(snap.cache) > self._cache_size:
+                snap.cache.popitem(last=False)
+        return table
+
+    @staticmethod
+    def _locate(snap: _Snapshot, customer_ids: np.ndarray) -> np.ndarray:
+        pos = np.searchsorted(snap.ids, customer_ids)
+        pos = np.minimum(pos, len(snap.ids) - 1)
+        found = snap.ids[pos] == customer_ids if len(snap.ids) else np.zeros(len(customer_ids), dtype=bool)
+        return np.where(found, pos, -1)
+
+    def get(self, customer_id) -> Optional[dict]:
+        snap = self._current()
+        pos = self._locate(snap, np.asarray([str(customer_id)], dtype=str))[0]
+        if pos < 0:
+            return None
+        table = self._read_row_group(snap, int(snap.row_group[pos]))
+        return table.slice(int(snap.offset[pos]), 1).to_pylist()[0]
+
+    def get_many(self, customer_ids: Iterable) -> pd.DataFrame:
+        """Rows for the requested customers in request order; unknown ids are omitted."""
+        snap = self._current()
+        wanted = np.asarray([str(c) for c in customer_ids], dtype=str)
+        pos = self._locate(snap, wanted)
+        hits = pos[pos >= 0]
+        if not len(hits):
+            return snap.file.schema_arrow.empty_table().to_pandas()
+        groups = snap.row_group[hits]
+        parts: List[pa.Table] = []
+        order: List[np.ndarray] = []
+        for rg in np.unique(groups):
+            sel = np.flatnonzero(groups == rg)
+            parts.append(self._read_row_group(snap, int(rg)).take(pa.array(snap.offset[hits[sel]])))
+            order.append(sel)
+        table = pa.concat_tables(parts).take(pa.array(np.argsort(np.concatenate(order), kind="stable")))
+        return table.to_pandas()
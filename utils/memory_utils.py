@@ -0,0 +1,165 @@
+import os
+import shutil
+import sys
+import tempfile
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from utils.config import memory, paths
+from utils.logging_utils import get_logger
+from utils.parquet_utils import write_parquet
+
+logger = get_logger("memory_utils")
+
+MB = 1024 * 1024
+
+
+def rss_bytes() -> Optional[int]:
+    """Current RSS, or None where only the peak is available (getrusage), which never falls after a spill."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil  # optional; current RSS on macOS and Windows
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+_warned_no_rss = False
+
+
+def _current_rss(stage: str) -> Optional[int]:
+    global _warned_no_rss
+    rss = rss_bytes()
+    if rss is None and not _warned_no_rss:
+        _warned_no_rss = True
+        logger.warning("%s: current RSS is not available on %s without psutil; chunk sizes stay fixed "
+                       "(pip install psutil to enable adaptive sizing)", stage, sys.platform)
+    return rss
+
+
+class MemoryBudget:
+    """RSS budget for one stage; a zero limit, or a platform without current RSS, never reports pressure."""
+
+    def __init__(self, stage: str, limit_mb: int):
+        self.stage = stage
+        self.limit = limit_mb * MB
+        self.soft_limit = int(self.limit * memory.soft_fraction)
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def under_pressure(self) -> bool:
+        if not self.enabled:
+            return False
+        rss = _current_rss(self.stage)
+        return rss is not None and rss >= self.soft_limit
+
+    def next_chunk_size(self, current: int) -> int:
+        """Halve the chunk under pressure, grow it back while well under the soft limit."""
+        if not self.enabled:
+            return current
+        rss = _current_rss(self.stage)
+        if rss is None:
+            return current
+        if rss >= self.soft_limit:
+            size = max(memory.min_chunk_rows, current // 2)
+        elif rss < self.soft_limit // 2:
+            size = min(memory.max_chunk_rows, current * 2)
+        else:
+            size = current
+        if size != current:
+            logger.info("%s: RSS %d MB of %d MB budget, chunk size %d -> %d",
+                        self.stage, rss // MB, self.limit // MB, current, size)
+        return size
+
+
+def budget_for(stage: str) -> MemoryBudget:
+    limit = int(os.environ.get(f"{stage.upper()}_MEMORY_MB", memory.stage_memory_mb))
+    return MemoryBudget(stage, limit)
+
+
+class SpillingAggregator:
+    """Collects partial aggregates and spills them to temporary Parquet when they outgrow their budget share.
+
+    `reduce` must be re-applicable: reduce(concat(reduce(a), reduce(b))) == reduce(concat(a, b)).
+    Spilling is driven by the size of the held partials rather than RSS, which does not fall after a spill.
+    """
+
+    def __init__(self, budget: MemoryBudget, reduce: Callable[[pd.DataFrame], pd.DataFrame]):
+        self.budget = budget
+        self.reduce = reduce
+        self.limit = int(budget.limit * memory.spill_fraction) if budget.enabled else 0
+        self._parts: List[pd.DataFrame] = []
+        self._bytes = 0
+        self._spilled: List[Tuple[str, int]] = []  # (path, in-memory bytes)
+        self._seq = 0
+        self._dir = None
+
+    def add(self, partial: pd.DataFrame) -> None:
+        if partial.empty:
+            return
+        self._parts.append(partial)
+        if not self.limit:
+            return
+        self._bytes += _frame_bytes(partial)
+        if self._bytes < self.limit:
+            return
+        # Fold the held parts first; only spill when the folded aggregate is itself large. Each fold follows at
+        # least limit/2 new bytes, so folding stays linear in the input.
+        frame = self.reduce(pd.concat(self._parts, ignore_index=True))
+        size = _frame_bytes(frame)
+        if size >= self.limit // 2:
+            self._parts, self._bytes = [], 0
+            self._spill(frame, size)
+        else:
+            self._parts, self._bytes = [frame], size
+
+    def _spill(self, frame: pd.DataFrame, size: int) -> None:
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix=f".spill-{self.budget.stage}-", dir=memory.spill_dir or paths.output_dir)
+        path = os.path.join(self._dir, f"part-{self._seq:05d}.parquet")
+        self._seq += 1
+        write_parquet(frame, path, buckets=0)
+        self._spilled.append((path, size))
+        logger.info("%s: spilled partial aggregate #%d (%d MB)", self.budget.stage, len(self._spilled), size // MB)
+
+    def _merge(self, batch: List[Tuple[str, int]]) -> pd.DataFrame:
+        frames = [pd.read_parquet(p) for p, _ in batch]
+        out = self.reduce(pd.concat(frames, ignore_index=True))
+        for p, _ in batch:
+            os.remove(p)
+        return out
+
+    def result(self) -> pd.DataFrame:
+        try:
+            queue = list(self._spilled)
+            # Tree-merge the spill files: merge the oldest ones in batches that fit the budget share and queue
+            # the result, until everything left fits in one merge. Each row is merged O(log files) times.
+            while len(queue) > 1 and sum(size for _, size in queue) > self.limit:
+                batch = queue[:2]
+                while len(batch) < len(queue) and sum(size for _, size in batch) + queue[len(batch)][1] <= self.limit:
+                    batch.append(queue[len(batch)])
+                queue = queue[len(batch):]
+                merged = self._merge(batch)
+                self._spill(merged, _frame_bytes(merged))
+                queue.append(self._spilled[-1])
+            frames = [pd.read_parquet(p) for p, _ in queue] + self._parts
+            if not frames:
+                return pd.DataFrame()
+            return self.reduce(pd.concat(frames, ignore_index=True))
+        finally:
+            self._parts, self._bytes = [], 0
+            if self._dir is not None:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+            self._spilled = []
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=False).sum())
@@ -0,0 +1,179 @@
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from utils.config import parquet
+from utils.logging_utils import get_logger
+
+logger = get_logger("parquet_utils")
+
+# Label-like columns produced by the stages; always dictionary encoded
+DICTIONARY_COLUMNS = {
+    "app_login",
+    "app_type",
+    "source",
+    "latest_ticket_source",
+    "latest_ticket_recency_bucket",
+    "yesterday_comment",
+    "mtd_most_positive_comment",
+    "contactable_vs_nc",
+    "collection_disposition",
+    "collection_sub_disposition",
+    "collection_sub_disposition2",
+    "disposition",
+    "mode",
+    "presentation_status",
+    "bounce_reason",
+    "payment_channel",
+}
+
+PART_TEMPLATE = "part-{:05d}.parquet"
+
+
+def customer_bucket(customer_ids: pd.Series, buckets: int) -> np.ndarray:
+    # hash_pandas_object uses a fixed key, so buckets are stable across runs and processes
+    hashed = pd.util.hash_pandas_object(customer_ids.astype(str), index=False).to_numpy()
+    return (hashed % np.uint64(buckets)).astype(np.int32)
+
+
+def parquet_files(path: str) -> List[str]:
+    """Data files behind `path`, which may be a single file or a sharded directory."""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, f)
+            for f in os.listdir(path)
+            if f.endswith(".parquet") and not f.startswith(".")
+        )
+    return [path] if os.path.exists(path) else []
+
+
+def _is_string(t: pa.DataType) -> bool:
+    return pa.types.is_string(t) or pa.types.is_large_string(t)
+
+
+def dictionary_columns(table: Union[pa.Table, pa.Schema]) -> List[str]:
+    schema = table if isinstance(table, pa.Schema) else table.schema
+    cols = [f.name for f in schema if _is_string(f.type) and f.name in DICTIONARY_COLUMNS]
+    if isinstance(table, pa.Table) and table.num_rows:
+        limit = table.num_rows * parquet.dictionary_max_ratio
+        for f in schema:
+            if f.name in cols or not _is_string(f.type):
+                continue
+            if pc.count_distinct(table.column(f.name)).as_py() <= limit:
+                cols.append(f.name)
+    return cols
+
+
+def _writer_options(table: Union[pa.Table, pa.Schema]) -> dict:
+    return {
+        "compression": parquet.compression,
+        "compression_level": parquet.compression_level,
+        "use_dictionary": dictionary_columns(table),
+        "write_statistics": True,
+    }
+
+
+def _tmp_sibling(path: str, tag: str) -> str:
+    head, tail = os.path.split(os.path.abspath(path))
+    return os.path.join(head, f".{tail}.{tag}-{uuid.uuid4().hex[:8]}")
+
+
+def _swap_into_place(tmp: str, path: str) -> None:
+    # Files are replaced atomically; a directory target is moved aside first
+    if os.path.isdir(path) or (os.path.isdir(tmp) and os.path.exists(path)):
+        old = _tmp_sibling(path, "old")
+        os.rename(path, old)
+        os.rename(tmp, path)
+        if os.path.isdir(old):
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.remove(old)
+    else:
+        os.replace(tmp, path)
+
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def to_table(df: Union[pd.DataFrame, pa.Table], schema: Optional[pa.Schema] = None) -> pa.Table:
+    if isinstance(df, pa.Table):
+        return df if schema is None else df.cast(schema)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def write_parquet(
+    df: Union[pd.DataFrame, pa.Table],
+    path: str,
+    buckets: Optional[int] = None,
+    row_group_size: Optional[int] = None,
+) -> str:
+    """Write a stage output atomically with zstd, selective dictionary encoding and sized row groups.
+
+    With `buckets` > 0 (default from PARQUET_HASH_BUCKETS) and a customer_id column, `path` becomes a
+    directory of hash(customer_id) shards that pd.read_parquet still reads as one frame.
+    """
+    table = to_table(df)
+    buckets = parquet.hash_buckets if buckets is None else buckets
+    row_group_size = row_group_size or parquet.row_group_size
+    options = _writer_options(table)
+
+    if buckets > 0 and "customer_id" in table.column_names:
+        tmp = _tmp_sibling(path, "tmp")
+        os.makedirs(tmp)
+        try:
+            ids = table.column("customer_id").to_pandas()
+            shard = customer_bucket(ids, buckets)
+            for b in range(buckets):
+                part = table.take(pa.array(np.flatnonzero(shard == b)))
+                pq.write_table(part, os.path.join(tmp, PART_TEMPLATE.format(b)), row_group_size=row_group_size, **options)
+            _swap_into_place(tmp, path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        logger.info("Wrote %d rows to %s in %d shards", table.num_rows, path, buckets)
+        return path
+
+    with atomic_path(path) as tmp:
+        pq.write_table(table, tmp, row_group_size=row_group_size, **options)
+    logger.info("Wrote %d rows to %s", table.num_rows, path)
+    return path
+
+
+@contextmanager
+def atomic_path(path: str):
+    """Yield a temp sibling path to write to; it replaces `path` only if the block succeeds."""
+    tmp = _tmp_sibling(path, "tmp")
+    try:
+        yield tmp
+        _swap_into_place(tmp, path)
+    except BaseException:
+        _remove(tmp)
+        raise
+
+
+@contextmanager
+def atomic_parquet_writer(path: str, schema: pa.Schema):
+    """Stream tables into `path` via a temp file; the target only appears once the writer closes cleanly."""
+    tmp = _tmp_sibling(path, "tmp")
+    writer = pq.ParquetWriter(tmp, schema, **_writer_options(schema))
+    try:
+        yield writer
+        writer.close()
+        _swap_into_place(tmp, path)
+    except BaseException:
+        writer.close()
+        _remove(tmp)
+        raise
+
@@ -0,0 +1,201 @@
+import os
+import sqlite3
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.logging_utils import get_logger
+
+logger = get_logger("payments_ledger")
+
+LEDGER_COLUMNS = ["transaction_id", "customer_id", "amt_payment", "create_date", "received_date"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    amt_payment REAL,
+    create_date TEXT,
+    received_date TEXT,
+    source_file TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS customer_month (
+    customer_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    sum_paid REAL,
+    payment_count INTEGER NOT NULL,
+    PRIMARY KEY (customer_id, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS customer_month_month ON customer_month (month);
+CREATE TABLE IF NOT EXISTS customer_latest (
+    customer_id TEXT PRIMARY KEY,
+    latest_payment_date TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    new_rows INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL,
+    kind TEXT
+);
+"""
+
+# A transaction counts once towards each distinct month of its create/received dates,
+# matching the batch job's "create_date OR received_date in month" filter
+MONTH_AGG_SQL = """
+INSERT INTO customer_month (customer_id, month, sum_paid, payment_count)
+SELECT customer_id, month, SUM(amt_payment), COUNT(*)
+FROM (
+    SELECT customer_id, amt_payment, substr(create_date, 1, 7) AS month
+    FROM staging WHERE create_date IS NOT NULL
+    UNION ALL
+    SELECT customer_id, amt_payment, substr(received_date, 1, 7) AS month
+    FROM staging
+    WHERE received_date IS NOT NULL
+      AND (create_date IS NULL OR substr(received_date, 1, 7) <> substr(create_date, 1, 7))
+)
+WHERE 1
+GROUP BY customer_id, month
+ON CONFLICT (customer_id, month) DO UPDATE SET
+    sum_paid = CASE
+        WHEN excluded.sum_paid IS NULL THEN sum_paid
+        WHEN sum_paid IS NULL THEN excluded.sum_paid
+        ELSE sum_paid + excluded.sum_paid
+    END,
+    payment_count = payment_count + excluded.payment_count;
+"""
+
+LATEST_SQL = """
+INSERT INTO customer_latest (customer_id, latest_payment_date)
+SELECT customer_id, MAX(MAX(COALESCE(create_date, received_date), COALESCE(received_date, create_date)))
+FROM staging
+WHERE COALESCE(create_date, received_date) IS NOT NULL
+GROUP BY customer_id
+ON CONFLICT (customer_id) DO UPDATE SET
+    latest_payment_date = MAX(latest_payment_date, excluded.latest_payment_date);
+"""
+
+CURRENT_MONTH_SQL = """
+SELECT cl.customer_id, cl.latest_payment_date, cm.sum_paid, cm.payment_count
+FROM customer_latest cl
+LEFT JOIN customer_month cm ON cm.customer_id = cl.customer_id AND cm.month = ?;
+"""
+
+
+def _iso_dates(s: pd.Series) -> pd.Series:
+    return pd.to_datetime(s, errors="coerce").dt.strftime("%Y-%m-%d")
+
+
+def _transaction_keys(df: pd.DataFrame, occurrences: Optional[Dict[str, int]] = None) -> pd.Series:
+    # Rows without a transaction_id are keyed on their content so re-exports still dedup. Identical rows
+    # within one file are separate payments, told apart by their occurrence number; `occurrences` carries
+    # the counts across chunks of the same file. The first occurrence keeps the plain content key.
+    content = pd.util.hash_pandas_object(
+        df[["customer_id", "amt_payment", "create_date", "received_date"]], index=False
+    ).astype(str)
+    occurrence = content.groupby(content).cumcount()
+    if occurrences is not None:
+        occurrence += content.map(occurrences).fillna(0).astype(int)
+        occurrences.update((occurrence + 1).groupby(content).max().to_dict())
+    keys = ("row:" + content).where(occurrence.eq(0), "row:" + content + ":" + occurrence.astype(str))
+    if "transaction_id" in df.columns:
+        tid = df["transaction_id"]
+        # Excel/CSV readers turn integer ids into floats when the column has gaps
+        if pd.api.types.is_float_dtype(tid) and (tid.dropna() % 1 == 0).all():
+            tid = tid.astype("Int64")
+        text = tid.astype(str).str.strip()
+        keys = text.where(tid.notna() & text.ne(""), keys)
+    return keys
+
+
+class PaymentsLedger:
+    """SQLite store of every seen transaction plus per-customer aggregates maintained on insert."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Ledgers created before files were tagged by kind; their rows keep a NULL kind
+        if "kind" not in {r[1] for r in self.conn.execute("PRAGMA table_info(ingested_files)")}:
+            self.conn.execute("ALTER TABLE ingested_files ADD COLUMN kind TEXT")
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS staging ("
+            "transaction_id TEXT PRIMARY KEY, customer_id TEXT NOT NULL, amt_payment REAL, "
+            "create_date TEXT, received_date TEXT, source_file TEXT)"
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "PaymentsLedger":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def is_ingested(self, path: str, kind: Optional[str] = None) -> bool:
+        """True if `path` is unchanged since it was last seen (and, with `kind`, was recorded as that kind)."""
+        st = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime, kind FROM ingested_files WHERE path = ?", (path,)).fetchone()
+        return (row is not None and row[0] == st.st_size and row[1] == st.st_mtime
+                and (kind is None or row[2] == kind))
+
+    def mark_ingested(self, path: str, new_rows: int, kind: str = "payments") -> None:
+        """Record `path` as seen; `kind` is "payments" for exports applied to the ledger, else "other"."""
+        st = os.stat(path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ingested_files (path, size, mtime, new_rows, ingested_at, kind) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime, new_rows, datetime.now().isoformat(timespec="seconds"), kind),
+            )
+
+    def apply(self, df: pd.DataFrame, source_file: str, occurrences: Optional[Dict[str, int]] = None) -> int:
+        """Append unseen transactions from a normalized frame and fold them into the aggregates.
+
+        Pass the same `occurrences` dict for every chunk of one file so repeated rows are numbered file-wide.
+        """
+        if df.empty:
+            return 0
+        frame = pd.DataFrame({
+            "customer_id": df["customer_id"].astype(str).str.strip(),
+            "amt_payment": pd.to_numeric(df["amt_payment"], errors="coerce") if "amt_payment" in df.columns else np.nan,
+            "create_date": _iso_dates(df["create_date"]) if "create_date" in df.columns else None,
+            "received_date": _iso_dates(df["received_date"]) if "received_date" in df.columns else None,
+        })
+        if "transaction_id" in df.columns:
+            frame["transaction_id"] = df["transaction_id"]
+        frame["transaction_id"] = _transaction_keys(frame, occurrences)
+        frame = frame.astype(object).where(frame.notna(), None)
+        records = [
+            (r.transaction_id, r.customer_id, r.amt_payment, r.create_date, r.received_date, source_file)
+            for r in frame.itertuples(index=False)
+        ]
+
+        with self.conn:
+            self.conn.execute("DELETE FROM staging")
+            # OR IGNORE also collapses repeated transaction_ids within the same file
+            self.conn.executemany("INSERT OR IGNORE INTO staging VALUES (?, ?, ?, ?, ?, ?)", records)
+            self.conn.execute(
+                "DELETE FROM staging WHERE transaction_id IN (SELECT transaction_id FROM transactions)"
+            )
+            new_rows = self.conn.execute("SELECT COUNT(*) FROM staging").fetchone()[0]
+            if new_rows:
+                self.conn.execute(MONTH_AGG_SQL)
+                self.conn.execute(LATEST_SQL)
+                self.conn.execute("INSERT INTO transactions SELECT * FROM staging")
+            self.conn.execute("DELETE FROM staging")
+        logger.info("Ledger: %d of %d rows from %s are new", new_rows, len(records), source_file)
+        return new_rows
+
+    def current_month(self, month_start: Optional[date] = None) -> pd.DataFrame:
+        month_start = month_start or date(date.today().year, date.today().month, 1)
+        out = pd.read_sql_query(CURRENT_MONTH_SQL, self.conn, params=(month_start.strftime("%Y-%m"),))
+        out = out.rename(columns={"sum_paid": "sum_paid_this_month", "payment_count": "payment_count_this_month"})
+        out["latest_payment_date"] = pd.to_datetime(out["latest_payment_date"]).dt.date
+        return out
@@ -0,0 +1,127 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from utils.logging_utils import get_logger
+
+logger = get_logger("schema_utils")
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]")
+
+
+def normalize_header(name) -> str:
+    """Lowercase, drop SQL table prefixes like `op.` and everything that is not a letter or digit."""
+    return _NON_ALNUM.sub("", str(name).strip().lower().replace("op.", ""))
+
+
+class Resolution(NamedTuple):
+    mapping: Dict[str, str]
+    unmapped: List[str]
+
+    def source_of(self, canonical: str) -> Optional[str]:
+        for src, dst in self.mapping.items():
+            if dst == canonical:
+                return src
+        return None
+
+
+class SchemaResolver:
+    """Maps file headers onto canonical column names via a precompiled alias table.
+
+    Exact matches on the normalized header are tried first; with `fuzzy`, remaining headers are
+    matched when they contain an alias (longest alias first). Results are cached per header
+    signature, so a folder of identically shaped files is only resolved once. `required` lists the
+    canonical columns a file must resolve to for it to count as this source.
+    """
+
+    def __init__(self, name: str, aliases: Dict[str, Iterable[str]], fuzzy: bool = False,
+                 required: Sequence[str] = ()):
+        self.name = name
+        self.canonical = list(aliases)
+        self.required = list(required)
+        self._exact: Dict[str, str] = {}
+        for canonical, names in aliases.items():
+            for alias in [canonical, *names]:
+                self._exact.setdefault(normalize_header(alias), canonical)
+        self._fuzzy: List[Tuple[str, str]] = (
+            sorted(self._exact.items(), key=lambda kv: -len(kv[0])) if fuzzy else []
+        )
+        self._cache: Dict[Tuple[str, ...], Resolution] = {}
+
+    def resolve(self, columns: Sequence) -> Resolution:
+        signature = tuple(str(c) for c in columns)
+        hit = self._cache.get(signature)
+        if hit is not None:
+            return hit
+
+        mapping: Dict[str, str] = {}
+        taken = set()
+        normalized = [(c, normalize_header(c)) for c in columns]
+        for col, key in normalized:
+            canonical = self._exact.get(key)
+            if canonical is not None and canonical not in taken:
+                mapping[col] = canonical
+                taken.add(canonical)
+        for col, key in normalized:
+            if col in mapping:
+                continue
+            for alias, canonical in self._fuzzy:
+                if canonical not in taken and alias in key:
+                    mapping[col] = canonical
+                    taken.add(canonical)
+                    break
+
+        result = Resolution(mapping, [c for c in columns if c not in mapping])
+        self._cache[signature] = result
+        if result.unmapped:
+            logger.info("%s: unmapped columns %s", self.name, result.unmapped)
+        return result
+
+    def missing(self, columns: Sequence) -> List[str]:
+        found = set(self.resolve(columns).mapping.values())
+        return [c for c in self.required if c not in found]
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        mapping = {src: dst for src, dst in self.resolve(df.columns).mapping.items() if src != dst}
+        return df.rename(columns=mapping) if mapping else df
+
+
+ALLOCATION = SchemaResolver(
+    "allocation",
+    {"customer_id": ["customerID", "CustomerID", "Customer_ID", "Customer Id", "Customer Ids"]},
+)
+
+PAYMENTS = SchemaResolver(
+    "payments",
+    {
+        "customer_id": [],
+        "amt_payment": [],
+        "create_date": ["DATE(op.create_date)"],
+        "transaction_id": [],
+        "mode": [],
+        "month_name": ["MONTHNAME(create_date)"],
+        "year": ["YEAR(create_date)"],
+        "presentation_status": [],
+        "bounce_reason": [],
+        "payment_channel": [],
+        "payment_from_customer": [],
+        "received_date": ["DATE(op.received_date)"],
+        "remarks": [],
+    },
+    fuzzy=True,
+    # IVR dumps share the drop folder and also resolve a customer_id; only amt_payment tells them apart
+    required=["customer_id", "amt_payment"],
+)
+
+IVR = SchemaResolver(
+    "ivr",
+    {
+        c: []
+        for c in [
+            "mobileNumber", "CustomerID", "campaignName", "leadName", "attemptNum", "startDate", "answerDate",
+            "endDate", "callDuration", "billSeconds", "creditsUsed", "disposition", "hangupCause", "hangupCode",
+            "clid", "dtmfTime", "voiceFileName", "circle", "operator", "digitsPressed", "circuitId", "slaveId",
+        ]
+    },
+)
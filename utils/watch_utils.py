@@ -0,0 +1,143 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from utils.logging_utils import get_logger
+
+logger = get_logger("watch_utils")
+
+# linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_Q_OVERFLOW = 0x00004000
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+_EVENT = struct.Struct("iIII")
+
+Signature = Tuple[int, float]
+
+
+def _inotify_fd(folder: str) -> Optional[int]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM
+        if libc.inotify_add_watch(fd, os.fsencode(folder), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class FolderWatcher:
+    """Reports files that appeared, changed or vanished in a drop folder.
+
+    With inotify (Linux) a file is only reported once it is named by a close-after-write or
+    moved-in event, so files still being copied are never picked up. In polling mode, for files
+    already present at startup and after an inotify queue overflow, a file is reported once its
+    (size, mtime) signature is stable across two scans.
+    """
+
+    def __init__(self, folder: str, poll_interval: float = 2.0, use_inotify: bool = True):
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self._fd = _inotify_fd(folder) if use_inotify else None
+        self._seen: Dict[str, Signature] = {}
+        self._closed: Set[str] = set()
+        self._overflow = False
+        # Files already in the folder are reported on the first call
+        self._pending: Dict[str, Signature] = self.scan()
+        logger.info("Watching %s using %s", folder, "inotify" if self._fd is not None else "polling")
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "FolderWatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def scan(self) -> Dict[str, Signature]:
+        out = {}
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            st = entry.stat()
+            out[entry.path] = (st.st_size, st.st_mtime)
+        return out
+
+    def _read_events(self) -> None:
+        data = b""
+        try:
+            while True:
+                chunk = os.read(self._fd, 65536)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            _, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self._overflow = True
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name:
+                self._closed.add(os.path.join(self.folder, os.fsdecode(name)))
+
+    def _wait(self, timeout: float) -> None:
+        if self._fd is None:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if ready:
+            self._read_events()
+
+    def changes(self, timeout: Optional[float] = None) -> Tuple[List[str], List[str]]:
+        """Block up to `timeout` seconds and return (new_or_changed, removed) paths."""
+        self._wait(self.poll_interval if timeout is None else timeout)
+        current = self.scan()
+        closed, self._closed = self._closed, set()
+        overflow, self._overflow = self._overflow, False
+        if overflow:
+            logger.warning("inotify queue overflowed; waiting for stable scans of changed files")
+        changed = []
+        for path, sig in current.items():
+            if self._seen.get(path) == sig:
+                self._pending.pop(path, None)
+                continue
+            if path in closed:
+                ready = True
+            elif self._fd is None or overflow or path in self._pending:
+                ready = self._pending.get(path) == sig
+            else:
+                # Still being written; its close or rename event will report it
+                continue
+            if ready:
+                changed.append(path)
+                self._seen[path] = sig
+                self._pending.pop(path, None)
+            else:
+                self._pending[path] = sig
+        for path in [p for p in self._pending if p not in current]:
+            del self._pending[path]
+        removed = [p for p in self._seen if p not in current]
+        for path in removed:
+            del self._seen[path]
+        return sorted(changed), removed